@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from EprimeReader import ReadAttributes, ScanAttributes
+import ParseEprimeEndopoid as Endo
+import SyntheticEprime
+
+# Benchmarks the task parsers and csv writers on synthetic cohorts (see
+# SyntheticEprime.py). Every benchmark is run Repeat times and the fastest
+# run is reported as files/s and MB/s, MB of the eprime files read for the
+# parsers and of the csv files written for the writers.
+
+def FileRun(FileName):
+    """Return the participant number and run of a synthetic eprime file."""
+    Name = os.path.basename(FileName)
+    Number = Name.split('-')[1].lstrip('0')
+    Run = int(Name.split('_Run')[1].split('-')[0])
+    return Number, Run
+
+def ParseFile(Task, FileName, Reader):
+    Number, Run = FileRun(FileName)
+    if Task == "VerbalMemA" or Task == "VerbalMemB":
+        return Endo.ParseVerbalMem(FileName, Number, Run, Reader=Reader)
+    elif Task == "VisualMem":
+        return Endo.ParseVisualMem(FileName, Number, Run, Reader=Reader)
+    elif Task == "Emotional":
+        return Endo.ParseEmotional(FileName, Number, Reader=Reader)
+
+def WriteFile(Task, Participant, RunTrials, OutFile):
+    if Task == "VerbalMemA" or Task == "VerbalMemB":
+        Endo.PrintVerbalMemShort(OutFile, RunTrials, Participant, Task)
+    elif Task == "VisualMem":
+        Endo.PrintVisualMemShort(OutFile, RunTrials, Participant)
+    elif Task == "Emotional":
+        Endo.PrintEmotionalShort(OutFile, RunTrials, Participant)
+
+Benchmarks = [
+    ("ParseVerbalMem", "VerbalMemA", "PrintVerbalMemShort"),
+    ("ParseEmotional", "Emotional", "PrintEmotionalShort"),
+    ("ParseVisualMem", "VisualMem", "PrintVisualMemShort"),
+]
+
+Specs = {"VerbalMemA": Endo.VerbalMemSpec, "Emotional": Endo.EmotionalSpec,
+    "VisualMem": Endo.VisualMemSpec}
+
+def Best(Repeat, Function):
+    Times = []
+    for _ in range(Repeat):
+        Start = time.perf_counter()
+        Result = Function()
+        Times.append(time.perf_counter() - Start)
+    return min(Times), Result
+
+def BenchmarkCohort(Root, OutDir, Size, Repeat, Reader):
+    """Return one result dict per parser and writer for a cohort of Size
+    participants written to Root."""
+    Results = []
+    for ParserName, Task, WriterName in Benchmarks:
+        ByParticipant = {}
+        for Participant in sorted(os.listdir(Root)):
+            TaskDir = os.path.join(Root, Participant, Task)
+            if os.path.isdir(TaskDir):
+                ByParticipant[Participant] = sorted(
+                    os.path.join(TaskDir, Name) for Name in os.listdir(TaskDir))
+        FileNames = [OneFile for Files in ByParticipant.values()
+            for OneFile in Files]
+        Bytes = sum(os.path.getsize(OneFile) for OneFile in FileNames)
+        Seconds, Trials = Best(Repeat, lambda: [ParseFile(Task, OneFile, Reader)
+            for OneFile in FileNames])
+        Results.append({"Name": ParserName, "Participants": Size,
+            "Files": len(FileNames), "Bytes": Bytes, "Seconds": Seconds})
+
+        RunTrials = {}
+        for Participant, Files in ByParticipant.items():
+            RunTrials[Participant] = Trials[:len(Files)]
+            Trials = Trials[len(Files):]
+        OutFiles = {Participant: os.path.join(OutDir, "{}_{}.csv".format(
+            Participant, Task)) for Participant in ByParticipant}
+        Seconds, _ = Best(Repeat, lambda: [WriteFile(Task, Participant,
+            RunTrials[Participant], OutFiles[Participant])
+            for Participant in ByParticipant])
+        Results.append({"Name": WriterName, "Participants": Size,
+            "Files": len(OutFiles), "Seconds": Seconds,
+            "Bytes": sum(os.path.getsize(OneFile) for OneFile in OutFiles.values())})
+    return Results
+
+def TracedBytes(Function):
+    """Return the memory traced while Function runs that is still in use
+    after it, i.e. the size of what it returned."""
+    tracemalloc.start()
+    try:
+        Result = Function()
+        return tracemalloc.get_traced_memory()[0], Result
+    finally:
+        tracemalloc.stop()
+
+def RunLists(Task, Number, Run, FileName):
+    """The per state lists of one run as the TrialMachine builds them."""
+    Spec, Run = Endo.RunSpec(Task, Run)
+    return Endo.RunMachine(Spec, FileName, Number, Run).Trials
+
+def TrialMemory(Root):
+    """Return (Task, trials, bytes per trial as per state lists, as
+    TrialColumns (ParseRun), as Trial records (IterTask)) for the whole
+    cohort under Root held in memory."""
+    Memory = []
+    for ParserName, Task, _ in Benchmarks:
+        Spec = Specs[Task]
+        FileNames = sorted(os.path.join(Root, Participant, Task, Name)
+            for Participant in os.listdir(Root)
+            for Name in os.listdir(os.path.join(Root, Participant, Task)))
+        Runs = [(FileName,) + FileRun(FileName) for FileName in FileNames]
+        ListBytes, Lists = TracedBytes(lambda: [RunLists(Task, Number, Run,
+            FileName) for FileName, Number, Run in Runs])
+        NumTrials = sum(len(Trials[0]) for Trials in Lists)
+        del Lists
+        ColumnBytes, _ = TracedBytes(lambda: [Endo.ParseRun(Task, Number, Run,
+            FileName)[0] for FileName, Number, Run in Runs])
+        RecordBytes, _ = TracedBytes(lambda: [list(Endo.IterTask(Spec,
+            FileName, Number, None if Task == "Emotional" else Run))
+            for FileName, Number, Run in Runs])
+        Memory.append((Task, NumTrials, ListBytes / NumTrials,
+            ColumnBytes / NumTrials, RecordBytes / NumTrials))
+    return Memory
+
+def PrintResults(Results):
+    print("{:<20} {:>6} {:>6} {:>8} {:>9} {:>9} {:>8}".format("Benchmark",
+        "Pars", "Files", "MB", "Seconds", "Files/s", "MB/s"))
+    for Result in Results:
+        MB = Result["Bytes"] / 1e6
+        print("{:<20} {:>6} {:>6} {:>8.2f} {:>9.4f} {:>9.1f} {:>8.2f}".format(
+            Result["Name"], Result["Participants"], Result["Files"], MB,
+            Result["Seconds"], Result["Files"] / Result["Seconds"],
+            MB / Result["Seconds"]))
+
+def Regressions(Results, Baseline, Tolerance):
+    """Return the results more than Tolerance (a fraction) slower in files/s
+    than the same benchmark and cohort size in Baseline."""
+    Before = {(Result["Name"], Result["Participants"]): Result
+        for Result in Baseline}
+    Slower = []
+    for Result in Results:
+        Old = Before.get((Result["Name"], Result["Participants"]))
+        if Old is not None and Old["Seconds"] / Old["Files"] < \
+                (1 - Tolerance) * Result["Seconds"] / Result["Files"]:
+            Slower.append(Result)
+    return Slower
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the eprime '
+        'parsers and csv writers on synthetic cohorts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50],
+        help="cohort sizes in participants (default 1 10 50)")
+    parser.add_argument('--repeat', type=int, default=3,
+        help="runs per benchmark, the fastest is reported (default 3)")
+    parser.add_argument('--utf16', action='store_true',
+        help="parse UTF-16 files like the original eprime files")
+    parser.add_argument('--mmap', action='store_true',
+        help="parse with ScanAttributes instead of ReadAttributes")
+    parser.add_argument('--memory', action='store_true', help="also report "
+        "the bytes per trial of the largest cohort held in memory, as per "
+        "state lists (TrialMachine), as TrialColumns (ParseRun) and as Trial "
+        "records (IterTask)")
+    parser.add_argument('--json', help="also save the results to this file")
+    parser.add_argument('--baseline', help="results of an earlier --json run, "
+        "exits with 1 when a benchmark got slower than --tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help="allowed files/s loss against --baseline (default 0.2)")
+    args = parser.parse_args()
+
+    Reader = ScanAttributes if args.mmap else ReadAttributes
+    Results = []
+    Memory = []
+    with tempfile.TemporaryDirectory() as TmpDir:
+        for Size in args.sizes:
+            Root = os.path.join(TmpDir, "eprime{}".format(Size))
+            OutDir = os.path.join(TmpDir, "csv{}".format(Size))
+            os.makedirs(OutDir)
+            SyntheticEprime.WriteCohort(Root, Size,
+                Encoding="utf-16" if args.utf16 else "utf-8")
+            Results += BenchmarkCohort(Root, OutDir, Size, args.repeat, Reader)
+        if args.memory:
+            Memory = TrialMemory(os.path.join(TmpDir, "eprime{}".format(
+                max(args.sizes))))
+    PrintResults(Results)
+    if Memory:
+        print("{:<20} {:>8} {:>13} {:>13} {:>13}".format("Task", "Trials",
+            "Lists B/tr", "Columns B/tr", "Records B/tr"))
+        for Row in Memory:
+            print("{:<20} {:>8} {:>13.1f} {:>13.1f} {:>13.1f}".format(*Row))
+    if args.json is not None:
+        with open(args.json, 'w') as Out:
+            json.dump(Results, Out, indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as F:
+            Slower = Regressions(Results, json.load(F), args.tolerance)
+        for Result in Slower:
+            print("slower than baseline: {} ({} participants)".format(
+                Result["Name"], Result["Participants"]))
+        if Slower:
+            sys.exit(1)
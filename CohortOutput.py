@@ -0,0 +1,165 @@
+import json
+import os
+
+# A consolidated csv file per task, <Root>/<Task>.csv, with the rows of all
+# participants. Rows are kept in segments of one (Participant, Run), their
+# byte ranges are in the sidecar index <Root>/<Task>.index.json.
+#
+# Adding a participant appends its runs and rewrites the small index. When a
+# participant is parsed again, its new runs are appended and the bytes of
+# its old runs are overwritten with newlines, which R (read.csv) and pandas
+# skip as blank lines, so the file is always a readable csv. The file is
+# compacted once more than half of it is blank.
+
+class CohortFile:
+    """Consolidated csv file of one task, see Upsert."""
+    def __init__(self, FileName, Header):
+        self.FileName = FileName
+        self.IndexName = os.path.splitext(FileName)[0] + ".index.json"
+        self.Header = Header
+        self.Index = None
+        if os.path.exists(self.IndexName):
+            with open(self.IndexName) as F:
+                self.Index = json.load(F)
+        if (self.Index is None or self.Index["Header"] != Header
+                or not os.path.exists(FileName)):
+            # new file or new columns, the participants are added again
+            self._Reset()
+        self._Recover()
+
+    def _Reset(self):
+        Data = self.Header.encode()
+        with open(self.FileName, 'wb') as Out:
+            Out.write(Data)
+        self.Index = {"Header": self.Header, "Size": len(Data),
+            "Segments": {}, "Dead": [], "Blank": 0}
+        self._SaveIndex()
+
+    def _SaveIndex(self):
+        Tmp = self.IndexName + ".tmp"
+        with open(Tmp, 'w') as F:
+            json.dump(self.Index, F, indent=1, sort_keys=True)
+        os.replace(Tmp, self.IndexName)
+
+    def _Recover(self):
+        """Repair the file after an interrupted write: rows appended after
+        the last saved index are cut off, dead segments are blanked and an
+        interrupted compaction is indexed again from the rows."""
+        Size = os.path.getsize(self.FileName)
+        if Size < self.Index["Size"]:
+            self._Reindex()
+        elif Size > self.Index["Size"]:
+            with open(self.FileName, 'r+b') as F:
+                F.truncate(self.Index["Size"])
+        if self.Index["Dead"]:
+            self._Blank()
+
+    def _Reindex(self):
+        Segments = {}
+        Names = self.Header.rstrip("\n").split(",")
+        Participant, Run = Names.index("Participant"), Names.index("Run")
+        with open(self.FileName, 'rb') as F:
+            Offset = len(F.readline())
+            for Line in F:
+                Fields = Line.decode().rstrip("\n").split(",")
+                if len(Fields) == len(Names):
+                    Key = "{}/{}".format(Fields[Participant], Fields[Run])
+                    Start, Length = Segments.get(Key, (Offset, 0))
+                    Segments[Key] = [Start, Offset + len(Line) - Start]
+                Offset += len(Line)
+        self.Index.update(Size=Offset, Segments=Segments, Dead=[],
+            Blank=Offset - len(self.Header) - sum(Length
+                for _, Length in Segments.values()))
+        self._SaveIndex()
+
+    def _Blank(self):
+        with open(self.FileName, 'r+b') as F:
+            for Offset, Length in self.Index["Dead"]:
+                F.seek(Offset)
+                F.write(b"\n" * Length)
+            F.flush()
+            os.fsync(F.fileno())
+        self.Index["Blank"] += sum(Length for _, Length in self.Index["Dead"])
+        self.Index["Dead"] = []
+        self._SaveIndex()
+
+    def Participants(self):
+        return {Key.rsplit("/", 1)[0] for Key in self.Index["Segments"]}
+
+    def Upsert(self, Participant, RunTexts):
+        """Replace all runs of Participant by RunTexts, the csv lines of
+        each run (Run is 1, 2, ...). The new runs are appended and the old
+        ones blanked, the rest of the file is not touched."""
+        Segments = self.Index["Segments"]
+        Old = [Key for Key in Segments
+            if Key.rsplit("/", 1)[0] == Participant]
+        Offset = self.Index["Size"]
+        New = {}
+        with open(self.FileName, 'ab') as Out:
+            for RunNum, Text in enumerate(RunTexts, 1):
+                Data = Text.encode()
+                Out.write(Data)
+                New["{}/{}".format(Participant, RunNum)] = [Offset, len(Data)]
+                Offset += len(Data)
+            Out.flush()
+            os.fsync(Out.fileno())
+        self.Index["Dead"] += [Segments.pop(Key) for Key in Old]
+        Segments.update(New)
+        self.Index["Size"] = Offset
+        self._SaveIndex()
+        if self.Index["Dead"]:
+            self._Blank()
+        if self.Index["Blank"] > self.Index["Size"] // 2:
+            self.Compact()
+
+    def Compact(self):
+        """Rewrite the file without blank lines, segments in key order."""
+        if self.Index["Blank"] == 0:
+            return
+        Tmp = self.FileName + ".tmp"
+        Header = self.Header.encode()
+        Segments = {}
+        with open(self.FileName, 'rb') as F, open(Tmp, 'wb') as Out:
+            Out.write(Header)
+            Offset = len(Header)
+            for Key, (Start, Length) in sorted(self.Index["Segments"].items()):
+                F.seek(Start)
+                Out.write(F.read(Length))
+                Segments[Key] = [Offset, Length]
+                Offset += Length
+            Out.flush()
+            os.fsync(Out.fileno())
+        os.replace(Tmp, self.FileName)
+        self.Index.update(Size=Offset, Segments=Segments, Dead=[], Blank=0)
+        self._SaveIndex()
+
+class CohortData:
+    """The consolidated csv files of all tasks under Root."""
+    def __init__(self, Root):
+        self.Root = Root
+        self.Files = {}
+        # participants of the files not opened yet, from their index
+        self.Indexed = {}
+        os.makedirs(Root, exist_ok=True)
+
+    def File(self, Task, Header):
+        if Task not in self.Files or self.Files[Task].Header != Header:
+            self.Files[Task] = CohortFile(os.path.join(self.Root,
+                Task + ".csv"), Header)
+        return self.Files[Task]
+
+    def Exists(self, Task, Participant):
+        """True if Participant is in the file of Task."""
+        if Task in self.Files:
+            return Participant in self.Files[Task].Participants()
+        if Task not in self.Indexed:
+            self.Indexed[Task] = set()
+            IndexName = os.path.join(self.Root, Task + ".index.json")
+            if os.path.exists(IndexName):
+                with open(IndexName) as F:
+                    self.Indexed[Task] = {Key.rsplit("/", 1)[0]
+                        for Key in json.load(F)["Segments"]}
+        return Participant in self.Indexed[Task]
+
+    def Write(self, Task, Header, Participant, RunTexts):
+        self.File(Task, Header).Upsert(Participant, RunTexts)
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+
+# pyarrow is only needed for --dataset
+try:
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+from EprimeSummaries import FieldKind
+from TrialColumns import Categorical, TrialColumns
+
+Formats = {"parquet": ".parquet", "arrow": ".arrow"}
+
+def ToArrow(Spec, State, Column):
+    """Return a TrialColumns column as an arrow array with the same type,
+    NaN and NA codes as null. Responses (float columns of integer fields)
+    are int32, categorical columns dictionary encoded with their codes."""
+    if isinstance(Column, Categorical):
+        return pa.DictionaryArray.from_arrays(
+            pa.array(Column.Codes, mask=Column.Codes < 0),
+            pa.array(Column.Levels, pa.string()))
+    if Column.dtype == object:
+        return pa.array(Column, pa.string()).dictionary_encode()
+    if Column.dtype.kind == 'f':
+        Missing = np.isnan(Column)
+        if FieldKind(Spec, State) == "integer":
+            return pa.array(np.where(Missing, 0, Column).astype(np.int32),
+                mask=Missing)
+        return pa.array(Column, mask=Missing)
+    return pa.array(Column)
+
+def ToTable(Spec, Columns, RunTrials, **Constants):
+    """Return the trials of all runs of one participant, the TrialColumns of
+    each run, as an arrow table.
+
+    Columns and Constants are as for WriteShort, so the table has the
+    columns of the csv file, typed as in TrialColumns (see ToArrow).
+    """
+    NumTrials = [len(Trials) for Trials in RunTrials]
+    Trials = TrialColumns.Concat(RunTrials)
+    Arrays = []
+    for Header, Source in Columns:
+        if Source == "Run":
+            Arrays.append(pa.array(np.repeat(np.arange(1, len(NumTrials) + 1,
+                dtype=np.int16), NumTrials)))
+        elif isinstance(Source, str):
+            Arrays.append(pa.DictionaryArray.from_arrays(
+                pa.array(np.zeros(len(Trials), dtype=np.int8)),
+                pa.array([str(Constants[Source])])))
+        else:
+            Arrays.append(ToArrow(Spec, Source, Trials[Source]))
+    return pa.Table.from_arrays(Arrays, [Header for Header, _ in Columns])
+
+class TrialDataset:
+    """Typed columnar copy of the csv files, partitioned by task and
+    participant: Root/<Task>/<Participant>.parquet (or .arrow).
+
+    Arrow files are written uncompressed so they can be memory mapped.
+    """
+    def __init__(self, Root, Format="parquet"):
+        if pa is None:
+            raise ImportError("pyarrow is needed to write a trial dataset")
+        self.Root = Root
+        self.Format = Format
+
+    def FileName(self, Task, Participant):
+        return os.path.join(self.Root, Task, Participant + Formats[self.Format])
+
+    def Exists(self, Task, Participant):
+        return os.path.exists(self.FileName(Task, Participant))
+
+    def Write(self, Task, Participant, Table):
+        FileName = self.FileName(Task, Participant)
+        os.makedirs(os.path.dirname(os.path.abspath(FileName)), exist_ok=True)
+        Tmp = FileName + ".tmp"
+        if self.Format == "parquet":
+            pa.parquet.write_table(Table, Tmp)
+        else:
+            pa.feather.write_feather(Table, Tmp, compression="uncompressed")
+        os.replace(Tmp, FileName)
@@ -0,0 +1,81 @@
+from collections import namedtuple
+import argparse
+import os
+
+import numpy as np
+
+from EprimeSummaries import FormatValue, TaskTable
+from ListEndopoidFiles import ListParticipants
+
+# Task -- Task value of its TaskTemplates.csv rows
+# FileName -- master data file written
+# CondNums -- Condition -> CondNum, other conditions are NaN
+MdfSpec = namedtuple('MdfSpec', ['Task', 'FileName', 'CondNums'])
+
+Mdfs = [
+    MdfSpec("emotion", "MDF_Emotional.csv", {"Neutral": 1, "Negative": 2}),
+    MdfSpec("verbal", "MDF_Verbal.csv", {"AC": 1, "UL": 2}),
+    MdfSpec("visual", "MDF_Visual.csv", {"Match": 1, "Delay1": 2, "Delay4": 3}),
+]
+
+# template columns copied for every participant, CondNum is added last
+Columns = ["Condition", "Run", "TimeOnset", "DurationTime"]
+
+def ReadParticipants(FileName):
+    """Return the participants of an AvailableRuns file (first field)."""
+    with open(FileName) as F:
+        return [Line.split(',')[0] for Line in F if Line.strip()]
+
+def CondNums(Spec, Conditions):
+    """Return the CondNum of each condition through a lookup table of the
+    distinct conditions, NaN when the condition has no number."""
+    Levels, Inverse = np.unique(Conditions.astype(str), return_inverse=True)
+    Lookup = np.array([Spec.CondNums.get(Level, np.nan) for Level in Levels],
+        dtype=np.float64)
+    return Lookup[Inverse]
+
+def WriteMdf(Template, Spec, Participants, OutFile):
+    """Write the template rows of Spec.Task once for every participant.
+
+    The text after the participant of each template row is formatted once,
+    then every (participant, row) line is made at once and written in one
+    call. Numbers and NA are written as R's write.csv(na="NaN") would.
+    """
+    Rows = Template["Task"] == Spec.Task
+    Cells = [[FormatValue(Value, Template.Kinds[Name], "NaN", "NaN")
+        for Value in Template[Name][Rows]] for Name in Columns]
+    Cells.append([FormatValue(Value, "double", "NaN", "NaN")
+        for Value in CondNums(Spec, Template["Condition"][Rows])])
+    Suffixes = np.array(["," + ",".join(Row) + "\n" for Row in zip(*Cells)],
+        dtype=str)
+    Lines = np.char.add(np.repeat(np.array(Participants, dtype=str),
+        len(Suffixes)), np.tile(Suffixes, len(Participants)))
+    with open(OutFile, 'w', buffering=1 << 20) as Out:
+        Out.write(",".join(["#Participant"] + Columns + ["CondNum"]) + "\n")
+        Out.write("".join(Lines.tolist()))
+
+def CreateMasterDataFiles(TemplateFile, Participants, OutDir):
+    Template = TaskTable.FromCsv(TemplateFile)
+    os.makedirs(OutDir, exist_ok=True)
+    for Spec in Mdfs:
+        WriteMdf(Template, Spec, Participants, os.path.join(OutDir, Spec.FileName))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create the task master '
+        'data files from TaskTemplates.csv.')
+    parser.add_argument('--template', default="./TaskTemplates.csv",
+        help="task templates (default ./TaskTemplates.csv)")
+    parser.add_argument('--participants', help="AvailableRuns file listing "
+        "the participants (e.g. AvailableRuns/Emotion.csv), without it the "
+        "participants are listed from --masterdir")
+    parser.add_argument('--masterdir',
+        default="/nfs/turbo/berent-lab/metabolic/Endopoid/Data/",
+        help="data location with a folder per participant")
+    parser.add_argument('--outdir', default="./MasterDataFiles",
+        help="output directory (default ./MasterDataFiles)")
+    args = parser.parse_args()
+    if args.participants is not None:
+        Participants = ReadParticipants(args.participants)
+    else:
+        Participants = ListParticipants(args.masterdir)
+    CreateMasterDataFiles(args.template, Participants, args.outdir)
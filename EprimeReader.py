@@ -0,0 +1,176 @@
+import codecs
+import mmap
+import os
+import re
+
+HeaderStart = "*** Header Start ***"
+HeaderEnd = "*** Header End ***"
+FrameStart = "*** LogFrame Start ***"
+FrameEnd = "*** LogFrame End ***"
+
+class LogFrame(dict):
+    """Attributes of one LogFrame (or the header) mapped key -> value.
+
+    Attributes:
+        Level -- LogFrame level, 0 for the header
+        LineNos -- key -> line number in the eprime file
+    """
+    def __init__(self, Level):
+        super().__init__()
+        self.Level = Level
+        self.LineNos = {}
+
+    def Line(self, Key):
+        """Return the stripped eprime line that held Key."""
+        return "{}: {}".format(Key, self[Key]).rstrip()
+
+def DetectEncoding(FileName):
+    """Return the encoding of an eprime file. E-Prime writes UTF-16 with a
+    BOM, converted copies are UTF-8."""
+    with open(FileName, 'rb') as F:
+        Head = F.read(4)
+    if Head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if Head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    # no BOM, ascii text has a zero high byte in UTF-16
+    if len(Head) >= 2 and Head[1] == 0:
+        return 'utf-16-le'
+    if len(Head) >= 2 and Head[0] == 0:
+        return 'utf-16-be'
+    return 'utf-8'
+
+def ReadLines(FileName, Corrections=(), newline=None):
+    """Yield the decoded lines of an eprime file with every (Old, New) pair
+    of Corrections replaced in each line."""
+    with open(FileName, 'r', encoding=DetectEncoding(FileName),
+            newline=newline) as F:
+        if not Corrections:
+            yield from F
+            return
+        for Line in F:
+            for Old, New in Corrections:
+                Line = Line.replace(Old, New)
+            yield Line
+
+def ConvertFile(InFile, OutFile, Corrections=()):
+    """Write a UTF-8 copy of an eprime file with Corrections applied."""
+    with open(OutFile, 'w', encoding='utf-8', newline='') as Out:
+        Out.writelines(ReadLines(InFile, Corrections, newline=''))
+
+def ReadLogFrames(FileName, Corrections=()):
+    """Yield each header/LogFrame block of an eprime file in a single pass.
+
+    The file may be the original UTF-16 or a converted copy, Corrections
+    are applied to each line as it is read (see ReadLines). Only the frame
+    being read is held in memory. Lines outside of a block (Level: N) only
+    set the level of the next frame.
+    """
+    Level = 0
+    Frame = None
+    for LineNo, Line in enumerate(ReadLines(FileName, Corrections), 1):
+        Line = Line.strip()
+        if Line == FrameStart:
+            Frame = LogFrame(Level)
+        elif Line == HeaderStart:
+            Frame = LogFrame(0)
+        elif Line == FrameEnd or Line == HeaderEnd:
+            if Frame is not None:
+                yield Frame
+            Frame = None
+        elif Frame is None:
+            if Line.startswith("Level:"):
+                Level = int(Line[6:])
+        else:
+            ColIdx = Line.find(':')
+            if ColIdx == -1:
+                continue
+            Key = Line[:ColIdx]
+            Frame[Key] = Line[ColIdx+1:].strip()
+            Frame.LineNos[Key] = LineNo
+    # truncated file, keep what was logged
+    if Frame is not None:
+        yield Frame
+
+def ReadAttributes(FileName, Keys=None, Corrections=()):
+    """Yield (Key, Value, LineNo) for every LogFrame attribute in file order.
+    Keys is ignored, it is there to match ScanAttributes."""
+    for Frame in ReadLogFrames(FileName, Corrections):
+        for Key, Value in Frame.items():
+            yield Key, Value, Frame.LineNos[Key]
+
+def KeyPattern(Keys, Encoding):
+    """Compile a bytes regex finding "Key: Value" lines of Keys in a file of
+    Encoding. Group 1 is the key, group 2 the stripped value."""
+    Keys = sorted((Key.rstrip(':') for Key in Keys), key=len, reverse=True)
+    if Encoding in ('utf-8', 'utf-8-sig'):
+        return re.compile(rb'^[ \t]*(' + b'|'.join(re.escape(Key.encode())
+            for Key in Keys) + rb'):[ \t]*([^\r\n]*?)[ \t]*\r?$', re.M)
+    # UTF-16-LE, every ascii character is followed by a zero byte
+    Space = rb'(?:[ \t]\x00)'
+    return re.compile(rb'(?:(?<=\n\x00)|\A(?:\xff\xfe)?)' + Space + rb'*('
+        + b'|'.join(re.escape(Key.encode('utf-16-le')) for Key in Keys)
+        + rb'):\x00' + Space + rb'*((?:[^\r\n].|[\r\n][^\x00])*?)' + Space
+        + rb'*(?:\r\x00)?(?=\n\x00|\Z)', re.S)
+
+def ScanAttributes(FileName, Keys, Corrections=()):
+    """Yield (Key, Value, LineNo) for the attributes in Keys only.
+
+    The file is memory mapped and searched with one compiled bytes regex,
+    so lines of other keys are never decoded or turned into strings. Only
+    matched values are decoded, and Corrections are applied to the matched
+    lines. UTF-8 and UTF-16-LE files are scanned, other encodings fall back
+    to ReadAttributes. Unlike ReadAttributes, repeated keys in a LogFrame
+    and keys outside of LogFrames are all yielded.
+    """
+    Encoding = DetectEncoding(FileName)
+    if Encoding == 'utf-16':
+        with open(FileName, 'rb') as F:
+            if F.read(2) == codecs.BOM_UTF16_LE:
+                Encoding = 'utf-16-le'
+    if Encoding not in ('utf-8', 'utf-8-sig', 'utf-16-le'):
+        yield from ReadAttributes(FileName, Keys, Corrections)
+        return
+    Codec = 'utf-8' if Encoding.startswith('utf-8') else Encoding
+    NewLine = '\n'.encode(Codec)
+    Pattern = KeyPattern(Keys, Encoding)
+
+    with open(FileName, 'rb') as F:
+        if os.fstat(F.fileno()).st_size == 0:
+            return
+        with mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ) as Map:
+            LineNo = 1
+            Last = 0
+            for Match in Pattern.finditer(Map):
+                Start = Match.start(1)
+                LineNo += Map[Last:Start].count(NewLine)
+                Last = Start
+                Key = Match.group(1).decode(Codec)
+                Value = Match.group(2).decode(Codec)
+                if Corrections:
+                    Line = "{}: {}".format(Key, Value)
+                    for Old, New in Corrections:
+                        Line = Line.replace(Old, New)
+                    Key, _, Value = Line.partition(':')
+                    Value = Value.strip()
+                yield Key, Value, LineNo
+
+class KeyMatcher:
+    """Finds which of a list of data keys (e.g. "Probe.RT:") a LogFrame
+    attribute is with a single dict lookup on its key.
+
+    Keys must match exactly, so "Answer:" does not match "MyAnswer:".
+    Attributes whose value contains one of Exclude are skipped.
+    """
+    def __init__(self, DataText, Exclude=()):
+        self.Index = {Text.rstrip(':'): TextNo for TextNo, Text in enumerate(DataText)}
+        self.Exclude = tuple(Exclude)
+
+    def Match(self, Key, Value):
+        """Return the DataText index of Key, None if it is not a data key."""
+        TextNo = self.Index.get(Key)
+        if TextNo is not None and self.Exclude:
+            for OneText in self.Exclude:
+                if OneText in Value:
+                    return None
+        return TextNo
@@ -0,0 +1,390 @@
+from collections import namedtuple
+import argparse
+import csv
+import glob
+import os
+import re
+
+import numpy as np
+
+from TrialColumns import Categorical, TrialColumns
+
+# incomplete participants (directory ending in 01) are left out
+ParticipantPattern = re.compile(r"I0.+0[^1]/|I0.+[1-9]./")
+
+# Name -- prefix of the output files
+# Tasks -- task directories read into one data set
+# Rt, Acc -- reaction time and accuracy columns
+# Condition -- condition column, Levels are (Name, value) of its conditions
+# First -- columns whose first value in a group is kept (dplyr x[1])
+SummarySpec = namedtuple('SummarySpec',
+    ['Name', 'Tasks', 'Rt', 'Acc', 'Condition', 'Levels', 'First'])
+
+Summaries = [
+    SummarySpec("Emotion", ("Emotional",), "ImageRt", "ImageAcc", "ImageAnswer",
+        (("Neutral", "Neutral"), ("Negative", "Negative")), ()),
+    SummarySpec("Verbal", ("VerbalMemA", "VerbalMemB"), "RT", "Acc", "BlockType",
+        (("Idea", "Idea"), ("Case", "Case")), ("VerbalType",)),
+    SummarySpec("Visual", ("VisualMem",), "ResponseRt", "ResponseAcc", "Running",
+        (("Match", "MatchTrialList"), ("Delay1", "DelayOneTrialList"),
+        ("Delay4", "DelayFourTrialList")), ()),
+]
+
+def SpecOf(Task):
+    """Return the SummarySpec of a task directory name."""
+    for Spec in Summaries:
+        if Task in Spec.Tasks:
+            return Spec
+
+def FormatNumber(Value):
+    """Format a double like R's write.csv: at most 15 significant digits,
+    fixed or scientific notation, whichever is narrower."""
+    if np.isnan(Value):
+        return "NaN"
+    if np.isinf(Value):
+        return "Inf" if Value > 0 else "-Inf"
+    Mantissa, Exp = "{:.14e}".format(Value).split('e')
+    Mantissa = Mantissa.rstrip('0').rstrip('.')
+    Exp = int(Exp)
+    Sig = len(Mantissa.lstrip('-').replace('.', ''))
+    Sci = "{}e{}{:02d}".format(Mantissa, '-' if Exp < 0 else '+', abs(Exp))
+    Fixed = "{:.{}f}".format(Value, max(0, Sig - 1 - Exp))
+    return Fixed if len(Fixed) <= len(Sci) else Sci
+
+class TaskTable:
+    """Trials of one or more csv files of a task, one numpy array per column.
+
+    Kinds maps each column to "integer", "double" (float64, NaN is NA) or
+    "character" (object, None is NA), the types read.csv would give them.
+    """
+    def __init__(self, Names, Columns, Kinds):
+        self.Names = list(Names)
+        self.Columns = Columns
+        self.Kinds = Kinds
+
+    def __len__(self):
+        return len(self.Columns[self.Names[0]]) if self.Names else 0
+
+    def __getitem__(self, Name):
+        return self.Columns[Name]
+
+    @classmethod
+    def FromTrials(cls, Spec, Columns, RunTrials, **Constants):
+        """Build the table of one participant from the TrialColumns of its
+        runs, Columns and Constants are as for
+        ParseEprimeEndopoid.WriteShort."""
+        NumTrials = [len(Trials) for Trials in RunTrials]
+        Trials = TrialColumns.Concat(RunTrials)
+        Data = {}
+        Kinds = {}
+        for Header, Source in Columns:
+            if Source == "Run":
+                Data[Header] = np.repeat(np.arange(1, len(NumTrials) + 1,
+                    dtype=np.float64), NumTrials)
+                Kinds[Header] = "integer"
+            elif isinstance(Source, str):
+                Data[Header] = np.full(sum(NumTrials), Constants[Source],
+                    dtype=object)
+                Kinds[Header] = "character"
+            else:
+                Column = Trials[Source]
+                Kinds[Header] = FieldKind(Spec, Source)
+                if isinstance(Column, Categorical):
+                    Data[Header] = Column.Values()
+                elif Kinds[Header] == "character":
+                    Data[Header] = Column
+                else:
+                    Data[Header] = Column.astype(np.float64)
+        return cls([Header for Header, _ in Columns], Data, Kinds)
+
+    @classmethod
+    def FromCsv(cls, FileName):
+        """Read a parsed csv file, "NA" is missing. Blank lines (e.g. of a
+        CohortOutput file) are skipped."""
+        with open(FileName, newline='') as F:
+            Rows = [Row for Row in csv.reader(F) if Row]
+        Names = Rows[0]
+        Data = {}
+        Kinds = {}
+        for Idx, Name in enumerate(Names):
+            Values = [Row[Idx] for Row in Rows[1:]]
+            Kinds[Name] = TextKind(Values)
+            if Kinds[Name] == "character":
+                Data[Name] = np.array([None if Value == "NA" else Value
+                    for Value in Values], dtype=object)
+            else:
+                Data[Name] = np.array([np.nan if Value == "NA" else float(Value)
+                    for Value in Values], dtype=np.float64)
+        return cls(Names, Data, Kinds)
+
+    @classmethod
+    def Concat(cls, Tables):
+        """Stack tables by column name like dplyr bind_rows, missing columns
+        are NA and integer columns become double when mixed."""
+        Names = []
+        for Table in Tables:
+            Names.extend(Name for Name in Table.Names if Name not in Names)
+        Data = {}
+        Kinds = {}
+        for Name in Names:
+            Found = {Table.Kinds[Name] for Table in Tables if Name in Table.Kinds}
+            for Kind in ("character", "double", "integer"):
+                if Kind in Found:
+                    Kinds[Name] = Kind
+                    break
+            Parts = []
+            for Table in Tables:
+                if Name not in Table.Kinds:
+                    Parts.append(np.full(len(Table), None if Kinds[Name]
+                        == "character" else np.nan, dtype=object
+                        if Kinds[Name] == "character" else np.float64))
+                elif Kinds[Name] == "character" and Table.Kinds[Name] != "character":
+                    Parts.append(np.array([FormatValue(Value, Table.Kinds[Name])
+                        for Value in Table[Name]], dtype=object))
+                else:
+                    Parts.append(Table[Name])
+            Data[Name] = np.concatenate(Parts) if Parts else np.empty(0)
+        return cls(Names, Data, Kinds)
+
+    def Write(self, FileName, Missing="NA", NA="NA"):
+        """Write like R's write.csv(quote=F, row.names=F, na=NA). Missing is
+        the text of a NaN double, "NaN" for computed columns."""
+        Cells = [[FormatValue(Value, self.Kinds[Name], Missing, NA)
+            for Value in self.Columns[Name]] for Name in self.Names]
+        with open(FileName, 'w', buffering=1 << 20) as Out:
+            Out.write(",".join(self.Names) + "\n")
+            Out.write("".join(",".join(Row) + "\n" for Row in zip(*Cells)))
+
+def FieldKind(Spec, State):
+    """Return the type of a *State column of Spec, as read.csv would read
+    it from the csv file: "double", "integer" or "character". The typed
+    outputs (ColumnarOutput, SqliteOutput) are derived from it."""
+    for Field in Spec.Fields:
+        if Field.State is State:
+            if Field.Scale:
+                return "double"
+            return "integer" if Field.Convert is int else "character"
+    # TrialNum, Block
+    return "integer"
+
+IntegerText = re.compile(r"[-+]?\d+$")
+
+def TextKind(Values):
+    """Return the read.csv type of a column of csv text."""
+    Values = [Value for Value in Values if Value != "NA"]
+    if all(IntegerText.match(Value) for Value in Values):
+        return "integer"
+    try:
+        for Value in Values:
+            float(Value)
+    except ValueError:
+        return "character"
+    return "double"
+
+def FormatValue(Value, Kind, Missing="NA", NA="NA"):
+    if Kind == "character":
+        return NA if Value is None else Value
+    if np.isnan(Value) and Kind == "integer":
+        return NA
+    if Kind == "integer":
+        return str(int(Value))
+    if np.isnan(Value):
+        return Missing
+    return FormatNumber(Value)
+
+class Groups:
+    """Rows of a TaskTable grouped by Keys in sorted key order, as with
+    dplyr group_by. All reductions are done for every group at once."""
+    def __init__(self, Table, Keys):
+        Code = np.zeros(len(Table), dtype=np.int64)
+        for Key in Keys:
+            Levels, Inverse = np.unique(Table[Key], return_inverse=True)
+            Code = Code * len(Levels) + Inverse
+        _, self.FirstRow, self.Inverse = np.unique(Code, return_index=True,
+            return_inverse=True)
+        self.Size = len(self.FirstRow)
+        self.N = self.Count(np.ones(len(Table), dtype=bool))
+
+    def Count(self, Mask):
+        return np.bincount(self.Inverse, weights=Mask, minlength=self.Size)
+
+    def SumMs(self, Values, Mask=None):
+        """Sum of Values * 1000 where Mask, NA removed. Values are s with
+        at most 3 decimals, so the ms are summed exactly."""
+        Keep = ~np.isnan(Values)
+        if Mask is not None:
+            Keep &= Mask
+        Weights = np.round(np.where(Keep, Values, 0) * 1000)
+        return np.bincount(self.Inverse, weights=Weights, minlength=self.Size)
+
+    def First(self, Values):
+        return Values[self.FirstRow]
+
+# counts and sums kept for every group of Totals, RTs in ms without NA
+Counts = ("Trials", "NoResp", "Correct", "Incorrect", "RtMs", "CorrectRtMs",
+    "IncorrectRtMs")
+
+class Totals:
+    """Counts and RT sums of trials per (Participant, Run, Condition) group,
+    updated one trial at a time while parsing. Memory only grows with the
+    number of groups. Accuracy is 0 or 1.
+
+    Groups maps a key tuple to a list of Counts. A TrialMachine keys its
+    trials by (Condition,) only, AddRun adds them to the totals of a
+    participant. First keeps the SummarySpec.First values of each
+    (Participant, Run) in the order they were added.
+    """
+    def __init__(self):
+        self.Groups = {}
+        self.First = {}
+
+    def Add(self, Key, Acc, RtMs):
+        Group = self.Groups.get(Key)
+        if Group is None:
+            Group = self.Groups[Key] = [0] * len(Counts)
+        Group[0] += 1
+        if RtMs == "NA":
+            Group[1] += 1
+            RtMs = 0
+        Group[4] += RtMs
+        if Acc == 1:
+            Group[2] += 1
+            Group[5] += RtMs
+        elif Acc == 0:
+            Group[3] += 1
+            Group[6] += RtMs
+
+    def AddRun(self, Participant, Run, RunTotals, First=()):
+        """Add the (Condition,) keyed totals of one run."""
+        self.First.setdefault((Participant, Run), tuple(First))
+        for (Condition,), Group in RunTotals.Groups.items():
+            self._AddGroup((Participant, Run, Condition), Group)
+
+    def Merge(self, Other):
+        for Key, First in Other.First.items():
+            self.First.setdefault(Key, First)
+        for Key, Group in Other.Groups.items():
+            self._AddGroup(Key, Group)
+
+    def _AddGroup(self, Key, Group):
+        Old = self.Groups.get(Key)
+        if Old is None:
+            self.Groups[Key] = list(Group)
+        else:
+            for Idx, Value in enumerate(Group):
+                Old[Idx] += Value
+
+    @classmethod
+    def FromTable(cls, Spec, Table):
+        """Return the totals of the trials of a TaskTable."""
+        Keys = ("Participant", "Run", Spec.Condition)
+        Group = Groups(Table, Keys)
+        Rt = Table[Spec.Rt]
+        Acc = Table[Spec.Acc]
+        Correct = Acc == 1
+        Incorrect = Acc == 0
+        Columns = [Group.N, Group.Count(np.isnan(Rt)), Group.Count(Correct),
+            Group.Count(Incorrect), Group.SumMs(Rt), Group.SumMs(Rt, Correct),
+            Group.SumMs(Rt, Incorrect)]
+        New = cls()
+        RunGroup = Groups(Table, Keys[:2])
+        for Row in RunGroup.FirstRow:
+            New.First[tuple(Table[Key][Row] for Key in Keys[:2])] = tuple(
+                Table[Name][Row] for Name in Spec.First)
+        for Idx, Row in enumerate(Group.FirstRow):
+            New.Groups[tuple(Table[Key][Row] for Key in Keys)] = [
+                Column[Idx] for Column in Columns]
+        return New
+
+    def Summary(self, Spec, Keys):
+        """Return the TaskTable of the Spec statistics of each group of
+        Keys, ("Participant", "Run") or ("Participant",), in key order."""
+        Levels = {Value: Idx for Idx, (_, Value) in enumerate(Spec.Levels)}
+        Sums = {}
+        for Key, Group in self.Groups.items():
+            Out = Sums.setdefault(Key[:len(Keys)],
+                np.zeros((len(Spec.Levels) + 1, len(Counts))))
+            Out[0] += Group
+            if Key[2] in Levels:
+                Out[Levels[Key[2]] + 1] += Group
+        First = {}
+        for Key, Values in self.First.items():
+            First.setdefault(Key[:len(Keys)], Values)
+        Order = sorted(Sums)
+        All = np.array([Sums[Key][0] for Key in Order]).reshape(-1, len(Counts))
+        Level = np.array([Sums[Key][1:] for Key in Order]).reshape(
+            -1, len(Spec.Levels), len(Counts))
+        Stats = [(Name, np.array([Key[Idx] for Key in Order], dtype=object),
+            "character" if Name == "Participant" else "integer")
+            for Idx, Name in enumerate(Keys)]
+        Stats += [(Name, np.array([First[Key][Idx] for Key in Order],
+            dtype=object), "character") for Idx, Name in enumerate(Spec.First)]
+        N, NoResp, Correct, Incorrect, RtMs, CorrectRtMs, IncorrectRtMs = All.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Stats += [
+                ("TotalTrials", N, "integer"),
+                ("NumNoResp", NoResp, "integer"),
+                ("NumIncorrect", Incorrect, "integer"),
+                ("AvgAcc", Correct / N, "double"),
+                ("AvgAllRt", RtMs / 1000 / N, "double"),
+                ("AvgCorrectRt", CorrectRtMs / 1000 / Correct, "double"),
+                ("AvgIncorrectRt", IncorrectRtMs / 1000 / Incorrect, "double"),
+            ]
+            for Idx, (Name, _) in enumerate(Spec.Levels):
+                Stats.append(("Avg{}Acc".format(Name),
+                    Level[:, Idx, 2] / Level[:, Idx, 0], "double"))
+            for Idx, (Name, _) in enumerate(Spec.Levels):
+                Stats.append(("Avg{}Rt".format(Name),
+                    Level[:, Idx, 5] / 1000 / Level[:, Idx, 2], "double"))
+        return TaskTable([Name for Name, _, _ in Stats],
+            {Name: Values for Name, Values, _ in Stats},
+            {Name: Kind for Name, _, Kind in Stats})
+
+def ListCsvFiles(Root, Tasks):
+    """Return the csv files of Tasks under Root/<Participant>/<Task> in
+    sorted order, without the incomplete participants."""
+    FileNames = []
+    for Task in Tasks:
+        FileNames += glob.glob(os.path.join(Root, '*', Task, '*csv'))
+    return [FileName for FileName in sorted(FileNames)
+        if ParticipantPattern.search(FileName)]
+
+def WriteSummaries(Root, OutDir, Parsed=None):
+    """Write <Name>Data.csv, <Name>RunSummary.csv and <Name>ParSummary.csv
+    of every SummarySpec to OutDir from the csv files under Root. Parsed
+    maps the absolute name of a csv file to its (TaskTable, Totals) from
+    the parser, those files are not read again. The files that are read
+    are added to Parsed."""
+    Parsed = {} if Parsed is None else Parsed
+    os.makedirs(OutDir, exist_ok=True)
+    for Spec in Summaries:
+        FileNames = ListCsvFiles(Root, Spec.Tasks)
+        if not FileNames:
+            continue
+        Tables = []
+        AllTotals = Totals()
+        for FileName in FileNames:
+            Table, FileTotals = Parsed.get(os.path.abspath(FileName),
+                (None, None))
+            if Table is None:
+                Table = TaskTable.FromCsv(FileName)
+                FileTotals = Totals.FromTable(Spec, Table)
+                Parsed[os.path.abspath(FileName)] = (Table, FileTotals)
+            Tables.append(Table)
+            AllTotals.Merge(FileTotals)
+        TaskTable.Concat(Tables).Write(os.path.join(OutDir,
+            Spec.Name + "Data.csv"))
+        AllTotals.Summary(Spec, ("Participant", "Run")).Write(
+            os.path.join(OutDir, Spec.Name + "RunSummary.csv"), "NaN")
+        AllTotals.Summary(Spec, ("Participant",)).Write(
+            os.path.join(OutDir, Spec.Name + "ParSummary.csv"), "NaN")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarize parsed endopoid '
+        'eprime csv files per run and participant.')
+    parser.add_argument('--root', default="./ConvertedEprime",
+        help="parsed csv files (default ./ConvertedEprime)")
+    parser.add_argument('--outdir', default="./EprimeSummaries",
+        help="output directory (default ./EprimeSummaries)")
+    args = parser.parse_args()
+    WriteSummaries(args.root, args.outdir)
@@ -1,31 +1,57 @@
 import os
 import re
-import glob
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 ParRuns = namedtuple('ParRuns', ['Name', 'Runs'])
 
+Tasks = ["emotion", "visual", "verbal"]
+
+# participant directories are scanned on this many threads, so the NFS
+# round trips of different participants overlap
+Threads = 16
+
 def ListParticipants(MasterDir):
-    Contents = os.listdir(MasterDir)
-    Participants = [x for x in Contents if re.match('abs13(ins|end)[0-9]+_[0-9]+', x)]
+    with os.scandir(MasterDir) as Contents:
+        Participants = [x.name for x in Contents
+            if re.match('abs13(ins|end)[0-9]+_[0-9]+', x.name)]
     Participants.sort()
     return(Participants)
 
-def ListTaskRuns(MasterDir, Participant, Task):
+def ExpectedRuns(Task):
     if Task == "emotion" or Task == "verbal":
-        Expected = ["run_01", "run_02", "run_03", "run_04"]
+        return ["run_01", "run_02", "run_03", "run_04"]
     else:
-        Expected = ["run_01", "run_02", "run_03"]
-   
-    RunNums = []
-    Runs = glob.glob(os.path.join(MasterDir, Participant, 'func', Task, 'run*'))
-    Runs = [os.path.basename(x) for x in Runs]
-    for Idx, Run in enumerate(Expected):
-        if Run in Runs:
-            RunNums.append(Idx+1)
-        else:
-            RunNums.append("NA")
-    return(RunNums)
+        return ["run_01", "run_02", "run_03"]
+
+def ListDir(Path):
+    """Return the entry names of Path, none if it is missing."""
+    try:
+        with os.scandir(Path) as Entries:
+            return [Entry.name for Entry in Entries]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+def ListTaskRuns(MasterDir, Participant, Task):
+    Runs = [x for x in ListDir(os.path.join(MasterDir, Participant, 'func',
+        Task)) if x.startswith('run')]
+    return [Idx+1 if Run in Runs else "NA"
+        for Idx, Run in enumerate(ExpectedRuns(Task))]
+
+def ScanParticipant(MasterDir, Participant):
+    """Return Task -> run numbers ("NA" for a missing run) of one
+    participant, listing each task directory once."""
+    return {Task: ListTaskRuns(MasterDir, Participant, Task) for Task in Tasks}
+
+def ScanMasterDir(MasterDir):
+    """Return Task -> ParRuns of every participant from one scan of
+    MasterDir, participants are scanned concurrently."""
+    Participants = ListParticipants(MasterDir)
+    with ThreadPoolExecutor(Threads) as Executor:
+        Scans = list(Executor.map(lambda x: ScanParticipant(MasterDir, x),
+            Participants))
+    return {Task: [ParRuns(OnePar, Scan[Task])
+        for OnePar, Scan in zip(Participants, Scans)] for Task in Tasks}
 
 def PrintRuns(Participants, Task, OutFile):
     with open(OutFile, 'w') as Out:
@@ -38,34 +64,9 @@ def PrintRuns(Participants, Task, OutFile):
             print("{}]\n".format(OnePar.Runs[NumRuns-1]), file=Out, end='')
 
 if __name__ == "__main__":
-    Tasks = ["emotion", "visual", "verbal"]
     MasterDir = "/nfs/turbo/berent-lab/metabolic/Endopoid/Data/"
 
-    Emotion = []
-    for OnePar in ListParticipants(MasterDir):
-        Emotion.append(
-            ParRuns(OnePar, ListTaskRuns(MasterDir, OnePar, 'emotion'))
-        )
-    PrintRuns(Emotion, 'emotion', 'AvailableRuns/Emotion.csv')
-   
-    Visual = []
-    for OnePar in ListParticipants(MasterDir):
-        Visual.append(
-            ParRuns(OnePar, ListTaskRuns(MasterDir, OnePar, 'visual'))
-        ) 
-    PrintRuns(Visual, 'visual', 'AvailableRuns/Visual.csv')
-
-    Verbal = []
-    for OnePar in ListParticipants(MasterDir):
-        Verbal.append(
-            ParRuns(OnePar, ListTaskRuns(MasterDir, OnePar, 'verbal'))
-        )
-    PrintRuns(Verbal, 'verbal', 'AvailableRuns/Verbal.csv')
-
-    
-
-    
-
-    
-    
-        
+    TaskRuns = ScanMasterDir(MasterDir)
+    PrintRuns(TaskRuns['emotion'], 'emotion', 'AvailableRuns/Emotion.csv')
+    PrintRuns(TaskRuns['visual'], 'visual', 'AvailableRuns/Visual.csv')
+    PrintRuns(TaskRuns['verbal'], 'verbal', 'AvailableRuns/Verbal.csv')
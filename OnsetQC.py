@@ -0,0 +1,245 @@
+from collections import namedtuple
+import argparse
+import os
+
+import numpy as np
+
+from EprimeSummaries import (Groups, ListCsvFiles, Summaries, TaskTable,
+    Totals)
+
+# Name -- SummarySpec whose csv files are checked
+# Template -- Task value of its TaskTemplates.csv rows
+# Onset -- trial onset column, s from the baseline like TimeOnset
+# Block -- block number column of the trials
+# Conditions -- template Condition -> name of the SummarySpec level
+OnsetSpec = namedtuple('OnsetSpec',
+    ['Name', 'Template', 'Onset', 'Block', 'Conditions'])
+
+OnsetSpecs = [
+    OnsetSpec("Emotion", "emotion", "ImageOnset", "Block",
+        {"Neutral": "Neutral", "Negative": "Negative"}),
+    OnsetSpec("Verbal", "verbal", "Onset", "Block", {"AC": "Idea", "UL": "Case"}),
+    OnsetSpec("Visual", "visual", "ResponseOnset", "BlockNum",
+        {"Match": "Match", "Delay1": "Delay1", "Delay4": "Delay4"}),
+]
+
+# a run is an outlier when the robust z score (median and MAD of all runs
+# of the task) of its drift or drift rate is above Threshold (Iglewicz and
+# Hoaglin). The MAD is at least the csv precision (1 ms, 1 ms/min), so runs
+# that only differ by rounding are not outliers.
+Threshold = 3.5
+DriftFloor = 0.001
+RateFloor = 1.0
+
+def LevelCodes(Levels, Values):
+    """Return the index in Levels ((Name, value) pairs) of every value, -1
+    for values of no level."""
+    Codes = np.full(len(Values), -1)
+    for Idx, (_, Value) in enumerate(Levels):
+        Codes[Values == Value] = Idx
+    return Codes
+
+def JoinBlocks(Runs, Starts, Ends, TrialRuns, Onsets, Tolerance=0.5):
+    """Return the block (index into Runs, Starts, Ends, sorted by run and
+    start) each trial onset falls in, -1 outside every block of its run.
+
+    All runs are joined in one searchsorted on run * Span + start. An onset
+    up to Tolerance s before a block start is in the block, so early onsets
+    are reported as drift and not as outside.
+    """
+    Span = np.nanmax(np.concatenate([Ends, Onsets, [0]])) + Tolerance + 1
+    Keys = Runs * Span + Starts - Tolerance
+    Rows = np.searchsorted(Keys, TrialRuns * Span + Onsets, side='right') - 1
+    Found = np.clip(Rows, 0, None)
+    with np.errstate(invalid='ignore'):
+        Inside = ((Rows >= 0) & (Runs[Found] == TrialRuns)
+            & (Onsets < Ends[Found]))
+    return np.where(Inside, Rows, -1)
+
+def GroupMedian(Group, Values, Size):
+    """Median of Values in each of Size groups, NaN is left out and the
+    median of an empty group is NaN."""
+    Keep = ~np.isnan(Values)
+    Group, Values = Group[Keep], Values[Keep]
+    Sorted = Values[np.lexsort((Values, Group))]
+    N = np.bincount(Group, minlength=Size)
+    Start = np.cumsum(N) - N
+    Median = np.full(Size, np.nan)
+    Has = N > 0
+    Median[Has] = (Sorted[(Start + (N - 1) // 2)[Has]]
+        + Sorted[(Start + N // 2)[Has]]) / 2
+    return Median
+
+def GroupSlope(Group, X, Y, Size):
+    """Least squares slope of Y on X in each of Size groups, NaN for groups
+    with less than two points."""
+    Keep = ~np.isnan(Y)
+    Group, X, Y = Group[Keep], X[Keep], Y[Keep]
+    Sum = lambda Values: np.bincount(Group, weights=Values, minlength=Size)
+    N, Sx, Sy = Sum(np.ones(len(X))), Sum(X), Sum(Y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Slope = (N * Sum(X * Y) - Sx * Sy) / (N * Sum(X * X) - Sx * Sx)
+    return np.where(N >= 2, Slope, np.nan)
+
+def RobustZ(Values, Floor):
+    """(Values - median) / (1.4826 * MAD), NaN is left out."""
+    if np.all(np.isnan(Values)):
+        return Values
+    Median = np.nanmedian(Values)
+    Mad = max(np.nanmedian(np.abs(Values - Median)), Floor)
+    return (Values - Median) / (1.4826 * Mad)
+
+def OnsetQC(Spec, Template, Table, Tolerance=0.5):
+    """Return the onset QC of every run of Table, the trials of Spec, as a
+    TaskTable. Runs are keyed by Participant, the SummarySpec.First columns
+    (VerbalType, VerbalMemA and VerbalMemB share the verbal template) and
+    Run.
+
+    Every trial is joined to the template block its onset falls in. Per run:
+    Outside -- trials in no template block
+    WrongCondition -- trials in a block of another condition
+    MissingBlocks -- template blocks without trials
+    MedianDrift, MaxDrift -- median and largest absolute difference (s) of
+                             the first onset of each block to the template
+    DriftRate -- slope of the block drift over the run, ms per minute
+    DriftZ, RateZ -- robust z scores over all runs of Table
+    Flags -- outside, condition, missing, drift and rate, NA for a good run
+    """
+    Summary = {One.Name: One for One in Summaries}[Spec.Name]
+    Rows = Template["Task"] == Spec.Template
+    Order = np.lexsort((Template["TimeOnset"][Rows], Template["Run"][Rows]))
+    Runs = Template["Run"][Rows][Order]
+    Starts = Template["TimeOnset"][Rows][Order]
+    Ends = Starts + Template["DurationTime"][Rows][Order]
+    Names = [Name for Name, _ in Summary.Levels]
+    BlockCodes = np.array([Names.index(Spec.Conditions[Condition])
+        if Condition in Spec.Conditions else -1
+        for Condition in Template["Condition"][Rows][Order]], dtype=int)
+
+    Onsets = Table[Spec.Onset]
+    Block = JoinBlocks(Runs, Starts, Ends, Table["Run"], Onsets, Tolerance)
+    Inside = Block >= 0
+    Codes = LevelCodes(Summary.Levels, Table[Summary.Condition])
+    RunKeys = ("Participant",) + Summary.First + ("Run",)
+    RunGroup = Groups(Table, RunKeys)
+    Size = RunGroup.Size
+
+    # template blocks with trials, per run
+    Hit = np.unique(RunGroup.Inverse[Inside] * len(Runs) + Block[Inside])
+    Hits = np.bincount(Hit // max(len(Runs), 1), minlength=Size)
+    RunNums = RunGroup.First(Table["Run"]).astype(int)
+    Blocks = np.bincount(Runs.astype(int),
+        minlength=RunNums.max(initial=0) + 1)[RunNums]
+
+    # drift of the first trial of every trial block, the block groups come
+    # from the run groups so the text keys are only sorted once
+    BlockNums = Table[Spec.Block].astype(np.int64)
+    _, First = np.unique(RunGroup.Inverse * (BlockNums.max(initial=0) + 1)
+        + BlockNums, return_index=True)
+    FirstBlock = Block[First]
+    # onsets have ms precision
+    Drift = np.round(np.where(FirstBlock >= 0,
+        Onsets[First] - Starts[FirstBlock], np.nan), 3)
+    DriftRun = RunGroup.Inverse[First]
+    MaxDrift = np.full(Size, -np.inf)
+    np.fmax.at(MaxDrift, DriftRun, np.abs(Drift))
+    MaxDrift[np.isinf(MaxDrift)] = np.nan
+    MedianDrift = GroupMedian(DriftRun, Drift, Size)
+    DriftRate = GroupSlope(DriftRun, Starts[np.clip(FirstBlock, 0, None)],
+        Drift, Size) * 1000 * 60
+
+    Outside = RunGroup.Count(~Inside)
+    Wrong = RunGroup.Count(Inside & (BlockCodes[np.clip(Block, 0, None)]
+        != Codes))
+    Missing = Blocks - Hits
+    DriftZ = RobustZ(MedianDrift, DriftFloor)
+    RateZ = RobustZ(DriftRate, RateFloor)
+    with np.errstate(invalid='ignore'):
+        Checks = [("outside", Outside > 0), ("condition", Wrong > 0),
+            ("missing", Missing > 0), ("drift", np.abs(DriftZ) > Threshold),
+            ("rate", np.abs(RateZ) > Threshold)]
+    Flags = np.array([";".join(Name for Name, Failed in Checks if Failed[Idx])
+        or None for Idx in range(Size)], dtype=object)
+
+    Stats = [("Participant", RunGroup.First(Table["Participant"]), "character"),
+        ("Run", RunNums, "integer")]
+    Stats += [(Name, RunGroup.First(Table[Name]), Table.Kinds[Name])
+        for Name in Summary.First]
+    Stats += [
+        ("Trials", RunGroup.N, "integer"),
+        ("Blocks", Blocks, "integer"),
+        ("Outside", Outside, "integer"),
+        ("WrongCondition", Wrong, "integer"),
+        ("MissingBlocks", Missing, "integer"),
+        ("MedianDrift", MedianDrift, "double"),
+        ("MaxDrift", MaxDrift, "double"),
+        ("DriftRate", DriftRate, "double"),
+        ("DriftZ", DriftZ, "double"),
+        ("RateZ", RateZ, "double"),
+        ("Flags", Flags, "character"),
+    ]
+    return TaskTable([Name for Name, _, _ in Stats],
+        {Name: np.asarray(Values, dtype=object if Kind == "character"
+            else np.float64) for Name, Values, Kind in Stats},
+        {Name: Kind for Name, _, Kind in Stats})
+
+def WriteOnsetQC(Root, OutDir, Template, Parsed=None, Tolerance=0.5):
+    """Write <Name>OnsetQC.csv of every OnsetSpec to OutDir from the csv
+    files under Root, Template is the TaskTable of TaskTemplates.csv.
+    Parsed is as for EprimeSummaries.WriteSummaries and also gets the files
+    that are read. Returns the QC TaskTable of each Name."""
+    Parsed = {} if Parsed is None else Parsed
+    os.makedirs(OutDir, exist_ok=True)
+    Results = {}
+    for Spec in OnsetSpecs:
+        Summary = {One.Name: One for One in Summaries}[Spec.Name]
+        FileNames = ListCsvFiles(Root, Summary.Tasks)
+        if not FileNames:
+            continue
+        Tables = []
+        for FileName in FileNames:
+            Table, _ = Parsed.get(os.path.abspath(FileName), (None, None))
+            if Table is None:
+                Table = TaskTable.FromCsv(FileName)
+                Parsed[os.path.abspath(FileName)] = (Table,
+                    Totals.FromTable(Summary, Table))
+            Tables.append(Table)
+        Results[Spec.Name] = OnsetQC(Spec, Template, TaskTable.Concat(Tables),
+            Tolerance)
+        Results[Spec.Name].Write(os.path.join(OutDir,
+            Spec.Name + "OnsetQC.csv"), "NaN")
+    return Results
+
+def PrintOnsetQC(Results):
+    """Print the flagged runs, returns their number."""
+    Flagged = 0
+    ByName = {One.Name: One for One in Summaries}
+    for Name, Table in Results.items():
+        Keys = ("Participant",) + ByName[Name].First
+        Bad = np.flatnonzero(Table["Flags"] != None)
+        Flagged += len(Bad)
+        print("{}: {} of {} runs flagged".format(Name, len(Bad), len(Table)))
+        for Row in Bad:
+            print("  {} run {}: {} (median drift {:.3f} s, {:.1f} ms/min)"
+                .format(" ".join(Table[Key][Row] for Key in Keys),
+                int(Table["Run"][Row]),
+                Table["Flags"][Row], Table["MedianDrift"][Row],
+                Table["DriftRate"][Row]))
+    return Flagged
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the trial onsets of '
+        'parsed endopoid eprime csv files against the task templates.')
+    parser.add_argument('--root', default="./ConvertedEprime",
+        help="parsed csv files (default ./ConvertedEprime)")
+    parser.add_argument('--template', default="./TaskTemplates.csv",
+        help="task templates (default ./TaskTemplates.csv)")
+    parser.add_argument('--outdir', default="./EprimeSummaries",
+        help="output directory of <Name>OnsetQC.csv (default "
+        "./EprimeSummaries)")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+        help="onsets up to this many s before a block start are in the "
+        "block (default 0.5)")
+    args = parser.parse_args()
+    PrintOnsetQC(WriteOnsetQC(args.root, args.outdir,
+        TaskTable.FromCsv(args.template), Tolerance=args.tolerance))
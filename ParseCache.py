@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+
+def HashFile(FileName):
+    Hash = hashlib.sha256()
+    with open(FileName, 'rb') as F:
+        for Chunk in iter(lambda: F.read(1 << 20), b''):
+            Hash.update(Chunk)
+    return Hash.hexdigest()
+
+def HashSources(FileNames):
+    """Hash of the parser source files, used as the parser version."""
+    Hash = hashlib.sha256()
+    for FileName in FileNames:
+        with open(FileName, 'rb') as F:
+            Hash.update(F.read())
+    return Hash.hexdigest()
+
+def Fingerprint(FileName, Old=None):
+    """Return the size, mtime and sha256 of FileName. The hash of Old is
+    reused when size and mtime did not change."""
+    try:
+        Stat = os.stat(FileName)
+    except FileNotFoundError:
+        return None
+    Print = {"File": FileName, "Size": Stat.st_size, "MtimeNs": Stat.st_mtime_ns}
+    if (Old is not None and Old["Size"] == Print["Size"]
+            and Old["MtimeNs"] == Print["MtimeNs"]):
+        Print["Sha256"] = Old["Sha256"]
+    else:
+        Print["Sha256"] = HashFile(FileName)
+    return Print
+
+class ParseCache:
+    """Manifest of parsed output files and the eprime files they came from.
+
+    Every output csv is mapped to the parser version and the size, mtime
+    and sha256 of each of its input files. An output is current when it
+    exists, the parser version is the same and no input changed. A file is
+    only hashed when its size or mtime changed, a file that was only
+    touched is still current.
+    """
+    def __init__(self, FileName, ParserVersion):
+        self.FileName = FileName
+        self.ParserVersion = ParserVersion
+        self.Outputs = {}
+        if os.path.exists(FileName):
+            with open(FileName) as F:
+                self.Outputs = json.load(F).get("Outputs", {})
+
+    def IsCurrent(self, OutFile, InFiles):
+        Entry = self.Outputs.get(os.path.abspath(OutFile))
+        if (Entry is None or Entry["ParserVersion"] != self.ParserVersion
+                or not os.path.exists(OutFile)):
+            return False
+        InFiles = [os.path.abspath(OneFile) for OneFile in InFiles]
+        if [Input["File"] for Input in Entry["Inputs"]] != InFiles:
+            return False
+        Current = []
+        for Input in Entry["Inputs"]:
+            Print = Fingerprint(Input["File"], Input)
+            if Print is None or Print["Sha256"] != Input["Sha256"]:
+                return False
+            Current.append(Print)
+        # touched but unchanged files are not hashed again next time
+        Entry["Inputs"] = Current
+        return True
+
+    def Update(self, OutFile, InFiles):
+        """Record OutFile as freshly built from InFiles."""
+        Old = self.Outputs.get(os.path.abspath(OutFile), {"Inputs": []})
+        OldInputs = {Input["File"]: Input for Input in Old["Inputs"]}
+        Inputs = []
+        for OneFile in InFiles:
+            OneFile = os.path.abspath(OneFile)
+            Inputs.append(Fingerprint(OneFile, OldInputs.get(OneFile)))
+        self.Outputs[os.path.abspath(OutFile)] = {
+            "ParserVersion": self.ParserVersion,
+            "Inputs": Inputs,
+        }
+
+    def Remove(self, OutFile):
+        self.Outputs.pop(os.path.abspath(OutFile), None)
+
+    def Save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.FileName)),
+            exist_ok=True)
+        Tmp = self.FileName + ".tmp"
+        with open(Tmp, 'w') as F:
+            json.dump({"Outputs": self.Outputs}, F, indent=1, sort_keys=True)
+        os.replace(Tmp, self.FileName)
@@ -1,6 +1,26 @@
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from functools import partial
+from itertools import repeat
 import argparse
+import glob
+import os
 import sys
+import time
+
+import CohortOutput
+import ColumnarOutput
+import EprimeReader
+import EprimeSummaries
+import OnsetQC
+import ParseJournal
+import ParseProfile
+import SqliteOutput
+from EprimeReader import (ConvertFile, KeyMatcher, ReadAttributes,
+    ScanAttributes)
+from ParseCache import HashSources, ParseCache
+from TrialColumns import TrialColumns
 
 class EndoError(Exception):
     """Base class for exception in this module."""
@@ -12,10 +32,12 @@ class EndoParseError(EndoError):
     Attributes:
         message -- explanation of the error
     """
-    def __init__(self, Message, Participant, InFile):
+    def __init__(self, Message, Participant, InFile, LineNo=None):
+        super().__init__(Message, Participant, InFile)
         self.Message = Message
         self.InFile = InFile
         self.Participant = Participant
+        self.LineNo = LineNo
     
 
 class EndoTransitionError(EndoError):
@@ -29,6 +51,7 @@ class EndoTransitionError(EndoError):
         message -- explanation of why the specific transition is not allowed
     """
     def __init__(self, LineNo, FoundStr, ExpectedStr, Participant, InFile):
+        super().__init__(LineNo, FoundStr, ExpectedStr, Participant, InFile)
         self.LineNo = LineNo
         self.FoundStr = FoundStr
         self.ExpectedStr = ExpectedStr
@@ -78,286 +101,578 @@ class VisualMemState(Enum):
     ResponseResp = 8    # int
     RunLists = 9        # int
     TrialNum = 10       # only used for indexing trials
-    
 
-def ParseVerbalMem(FileName, Participant, Run):
-    TruePeriodDurations = (32000, 44000, 44000, 44000, 44000, 32000)
+class Trial:
+    """One trial with a slot per member of States, the *State enum of its
+    task, as yielded by IterTask. Trials are indexed by state value (or
+    state) like the rows of TrialMachine and iterate in state order. A
+    record is only a named view of a row, the parsers return TrialColumns,
+    which are smaller."""
+    __slots__ = ()
+    States = None
 
-    DataText = [
-        "myStimulus:",
-        "instructText:",
-        "conAbst:",
-        "myCase:",
-        "Answer:",
-        "Probe.OnsetTime:",
-        "Probe.ACC:",
-        "Probe.RT:",
-        "Probe.RESP:",
-        "Probe.OnsetToOnsetTime:",
-        "fixation.OnsetTime:",
-        "Run{}Lists:".format(Run)
-    ]
+    def __init__(self, Row=()):
+        Row = list(Row) + [None] * (len(self.__slots__) - len(Row))
+        for Name, Value in zip(self.__slots__, Row):
+            setattr(self, Name, Value)
 
-    Trials = [[] for _ in range(VerbalMemState.TrialNum.value + 1)]
+    def __getitem__(self, Index):
+        if isinstance(Index, Enum):
+            Index = Index.value
+        return getattr(self, self.__slots__[Index])
 
-    # read all lines
-    Lines = []
-    with open(FileName, 'r') as F:
-        for Line in F:
-            Lines.append(Line.strip())
-
-    # check subject is same as input
-    for Line in Lines:
-        if "Subject:" in Line:
-            ColIdx = Line.find(':')
-            FileParticipant = Line[ColIdx+1:].strip().lstrip('0')
-            break
-    if FileParticipant != Participant:
-        raise EndoParseError(
-            " * * * PARTICIPANT MISMATCH * * *\n" +
-            "File Participant: {}".format(FileParticipant),
-            Participant=Participant, InFile=FileName)
-
-    # check for timings consistency
-    PeriodDurations = []
-    for Line in Lines:
-        if "PeriodDuration:" in Line:
-            ColIdx = Line.find(':')
-            PeriodDurations.append(int(Line[ColIdx+1:].strip()))
-    if PeriodDurations != list(TruePeriodDurations):
-        raise EndoParseError(
-            " * * * UNEXPECTED PERIOD DURATIONS * * *\n" +
-            "True period durations:     {}\n".format(TruePeriodDurations) +
-            "Expected period durations: {}".format(PeriodDurations),
-            Participant=Participant, InFile=FileName)
-
-    # find baseline time
-    BaselineTime = -1
-    for Line in Lines:
-        if "myDisDaqs.OnsetTime" in Line:
-            ColIdx = Line.find(':')
-            BaselineTime = float(Line[ColIdx+1:].strip())
-            break
-    if BaselineTime == -1:
-        raise EndoVerbalParseError(" * * * myDisDaqs.OnsetTime NOT FOUND * * *",
-            Participant=Participant, InFile=FileName)
-
-    # grab block lines  
-    BlockLines = []
-    for LineNo, Line in enumerate(Lines):
-        if "Run{}Lists:".format(Run) in Line:
-            BlockLines.append((Line, LineNo+1))
-    if not BlockLines:
-        raise EndoParseError("* * * BlockLines list EMPTY * * *",
-            Participant=Participant, InFile=FileName)
-
-    # grab condtitions
-    CondLines = []
-    for LineNo, Line in enumerate(Lines):
-        if "instructText:" in Line:
-            CondLines.append((Line, LineNo+1))
-    if not CondLines:
-        raise EndoParseError("* * * Conditions list EMPTY * * *",
-            Participant=Participant, InFile=FileName)
+    def __setitem__(self, Index, Value):
+        if isinstance(Index, Enum):
+            Index = Index.value
+        setattr(self, self.__slots__[Index], Value)
 
-    # grab data lines
-    DataLines = []
-    BlockIndex = 0
-    ConditionIndex = 0
-    for LineNo, Line in enumerate(Lines):
-        for TextNo, OneText in enumerate(DataText):
-            if OneText in Line:
-                if TextNo == VerbalMemState.RunLists.value:
-                    BlockIndex += 1
-                elif TextNo == VerbalMemState.Condition.value:
-                    ConditionIndex += 1
-                else:
-                    DataLines.append((Line, LineNo+1))
-                    if TextNo == VerbalMemState.FixOnset.value:
-                        DataLines.append(BlockLines[BlockIndex])
-                    elif TextNo == VerbalMemState.Stim.value:
-                        DataLines.append(CondLines[ConditionIndex])
-                break
+    def __len__(self):
+        return len(self.__slots__)
 
-    CurState = VerbalMemState.Stim
-    TrialCounter = 1
-    for Pairs in DataLines:
-        if CurState == VerbalMemState.Stim:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(Pairs[0][ColLoc+1:].strip())
-            CurState = VerbalMemState.Condition
-        elif CurState == VerbalMemState.Condition:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            CondName = Pairs[0].split()[1]
-            if CondName == "Abstract":
-                Trials[CurState.value].append("Idea")
-            elif CondName == "Lower":
-                Trials[CurState.value].append("Case")
-            else:
-                raise EndoParseError("Invalid conditon: {}, lineno: {}".
-                    format(CondName, Pairs[1]), 
-                    Participant=Participant, InFile=FileName)
-            CurState = VerbalMemState.Abst
-        elif CurState == VerbalMemState.Abst:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            tmp = Pairs[0][ColLoc+1:].strip()
-            if tmp == "a":
-                Trials[CurState.value].append("Abstract")
-            elif tmp == "c":
-                Trials[CurState.value].append("Concrete")
+    def __iter__(self):
+        return (getattr(self, Name) for Name in self.__slots__)
+
+    def __eq__(self, Other):
+        return type(self) is type(Other) and list(self) == list(Other)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join("{}={!r}".format(
+            Name, Value) for Name, Value in zip(self.__slots__, self)))
+
+def StateNames(States):
+    return tuple(State.name for State in sorted(States, key=lambda x: x.value))
+
+class VerbalTrial(Trial):
+    __slots__ = StateNames(VerbalMemState)
+    States = VerbalMemState
+
+class EmotionalTrial(Trial):
+    __slots__ = StateNames(EmotionalState)
+    States = EmotionalState
+
+class VisualTrial(Trial):
+    __slots__ = StateNames(VisualMemState)
+    States = VisualMemState
+
+
+# A task is described by a TaskSpec: the ordered TrialField list of one trial
+# and the run level checks. TrialMachine compiles a spec into an array
+# indexed transition table and feeds it the attributes of an eprime file.
+#
+# TrialField:
+#   State    -- *State member the value is stored under
+#   Key      -- eprime key, "{}" is replaced by the run number
+#   Convert  -- str -> value, raises ValueError/KeyError on bad input. Texts
+#               are interned by default, so a stimulus or condition text is
+#               stored once for a whole cohort
+#   Scale    -- divide by 1000 (ms -> s)
+#   Baseline -- subtract the baseline time before scaling
+#   AllowNA  -- an empty value is stored as "NA"
+#   Deferred -- block level key logged after its trials, it is given to
+#               every trial that passed the previous field
+#   Levels   -- known texts of a condition column, stored as int8 codes
+#               (TrialColumns.Categorical), None for free text
+TrialField = namedtuple('TrialField',
+    ['State', 'Key', 'Convert', 'Scale', 'Baseline', 'AllowNA', 'Deferred',
+     'Levels'],
+    defaults=(sys.intern, False, False, False, False, None))
+
+# TaskSpec:
+#   Name            -- used in error messages
+#   States          -- *State enum, one trials column per member
+#   Fields          -- TrialFields in file order
+#   Baseline        -- key holding the baseline time
+#   PeriodDurations -- expected PeriodDuration values, None to skip check
+#   Exclude         -- data key values containing these are ignored
+#   NALinks         -- (Rt, Resp) states, Rt is "NA" when Resp is "NA"
+#   OnTrial         -- called as OnTrial(Machine, Row) after each trial
+#   Aggregate       -- (Condition, Acc, Rt) states, every finished trial is
+#                      added to the EprimeSummaries.Totals of its condition
+#   Record          -- Trial class of one trial, see IterTask
+TaskSpec = namedtuple('TaskSpec',
+    ['Name', 'States', 'Fields', 'Baseline', 'PeriodDurations', 'Exclude',
+     'NALinks', 'OnTrial', 'Aggregate', 'Record'],
+    defaults=(None, (), (), None, None, Trial))
+
+def VerbalCondition(Value):
+    return {"Abstract": "Idea", "Lower": "Case"}[Value.split()[0]]
+
+def EmotionalBlock(Machine, Row):
+    # a new block starts whenever the image answer changes
+    if Machine.Last is None:
+        Row[EmotionalState.Block.value] = 1
+    else:
+        Row[EmotionalState.Block.value] = Machine.Last[EmotionalState.Block.value]
+        if Row[EmotionalState.ImageAns.value] != Machine.Last[EmotionalState.ImageAns.value]:
+            Row[EmotionalState.Block.value] += 1
+
+VerbalMemSpec = TaskSpec(
+    Name="verbal",
+    States=VerbalMemState,
+    Fields=(
+        TrialField(VerbalMemState.Stim, "myStimulus:"),
+        TrialField(VerbalMemState.Condition, "instructText:", VerbalCondition,
+            Deferred=True, Levels=("Idea", "Case")),
+        TrialField(VerbalMemState.Abst, "conAbst:",
+            {"a": "Abstract", "c": "Concrete"}.__getitem__,
+            Levels=("Abstract", "Concrete")),
+        TrialField(VerbalMemState.Case, "myCase:",
+            {"l": "Lower", "u": "Upper"}.__getitem__,
+            Levels=("Lower", "Upper")),
+        TrialField(VerbalMemState.Answer, "Answer:", int),
+        TrialField(VerbalMemState.Onset, "Probe.OnsetTime:", float,
+            Scale=True, Baseline=True),
+        TrialField(VerbalMemState.Acc, "Probe.ACC:", int),
+        TrialField(VerbalMemState.Rt, "Probe.RT:", float, Scale=True),
+        TrialField(VerbalMemState.Resp, "Probe.RESP:", int, AllowNA=True),
+        TrialField(VerbalMemState.Dur, "Probe.OnsetToOnsetTime:", float,
+            Scale=True),
+        TrialField(VerbalMemState.FixOnset, "fixation.OnsetTime:", float,
+            Scale=True, Baseline=True),
+        TrialField(VerbalMemState.RunLists, "Run{}Lists:", int, Deferred=True)),
+    Baseline="myDisDaqs.OnsetTime:",
+    PeriodDurations=(32000, 44000, 44000, 44000, 44000, 32000),
+    NALinks=((VerbalMemState.Rt, VerbalMemState.Resp),),
+    Aggregate=(VerbalMemState.Condition, VerbalMemState.Acc,
+        VerbalMemState.Rt),
+    Record=VerbalTrial)
+
+EmotionalSpec = TaskSpec(
+    Name="emotional",
+    States=EmotionalState,
+    Fields=(
+        TrialField(EmotionalState.ImageDis, "MyImage:"),
+        TrialField(EmotionalState.MyAnswer, "MyAnswer:", int),
+        TrialField(EmotionalState.ImageAns, "Answer:",
+            Levels=("Neutral", "Negative")),
+        TrialField(EmotionalState.ImageOnset, "ImageDisplay1.OnsetTime:", float,
+            Scale=True, Baseline=True),
+        TrialField(EmotionalState.ImageDur, "ImageDisplay1.Duration:", float,
+            Scale=True),
+        TrialField(EmotionalState.ImageAcc, "ImageDisplay1.ACC:", int),
+        TrialField(EmotionalState.ImageRt, "ImageDisplay1.RT:", float, Scale=True),
+        TrialField(EmotionalState.ImageResp, "ImageDisplay1.RESP:", int,
+            AllowNA=True),
+        TrialField(EmotionalState.DelayOnset, "ShortDelay.OnsetTime:", float,
+            Scale=True, Baseline=True),
+        TrialField(EmotionalState.DelayDur, "ShortDelay.Duration:", float,
+            Scale=True),
+        TrialField(EmotionalState.DelayRt, "ShortDelay.RT:", float, Scale=True),
+        TrialField(EmotionalState.DelayResp, "ShortDelay.RESP:", int,
+            AllowNA=True)),
+    Baseline="ImageDisplay1.OnsetTime:",
+    NALinks=((EmotionalState.ImageRt, EmotionalState.ImageResp),),
+    OnTrial=EmotionalBlock,
+    Aggregate=(EmotionalState.ImageAns, EmotionalState.ImageAcc,
+        EmotionalState.ImageRt),
+    Record=EmotionalTrial)
+
+VisualMemSpec = TaskSpec(
+    Name="visual",
+    States=VisualMemState,
+    Fields=(
+        TrialField(VisualMemState.Task, "Task:", int),
+        TrialField(VisualMemState.Answer, "Answer:", int),
+        TrialField(VisualMemState.MatchLocation, "MatchLocation:",
+            Levels=("Left", "Right")),
+        TrialField(VisualMemState.Running, "Running:", Levels=("MatchTrialList",
+            "DelayOneTrialList", "DelayFourTrialList")),
+        TrialField(VisualMemState.ResponseOnset, "Response.OnsetTime:", float,
+            Scale=True, Baseline=True),
+        TrialField(VisualMemState.ResponseOffset, "Response.OffsetTime:", float,
+            Scale=True, Baseline=True),
+        TrialField(VisualMemState.ResponseAcc, "Response.ACC:", int),
+        TrialField(VisualMemState.ResponseRt, "Response.RT:", float, Scale=True),
+        TrialField(VisualMemState.ResponseResp, "Response.RESP:", int,
+            AllowNA=True),
+        TrialField(VisualMemState.RunLists, "RunList{}:", int, Deferred=True)),
+    Baseline="ClearScreen.OnsetTime:",
+    PeriodDurations=(40000,) * 9,
+    Exclude=("PeriodList", "IFISBlockList"),
+    NALinks=((VisualMemState.ResponseRt, VisualMemState.ResponseResp),),
+    Aggregate=(VisualMemState.Running, VisualMemState.ResponseAcc,
+        VisualMemState.ResponseRt),
+    Record=VisualTrial)
+
+class TrialMachine:
+    """Runs a compiled TaskSpec over the attributes of one eprime file.
+
+    Feed every attribute in file order, then call Finish to run the run
+    level checks and get the trials (a list of per state lists). Times are
+    still in ms and relative to the start of eprime, see
+    TrialColumns.FromTrials.
+    With a Spec.Aggregate, Totals holds the counts and RT sums of the
+    finished trials per condition. With Stream, finished trials are put in
+    Ready (one row per trial, indexed by state value) instead of Trials.
+    """
+    def __init__(self, Spec, FileName, Participant, Run=None, Stream=False):
+        self.Spec = Spec
+        self.Stream = Stream
+        self.FileName = FileName
+        self.Participant = Participant
+        self.DataText = [Field.Key.format(Run) for Field in Spec.Fields]
+        self.NumFields = len(Spec.Fields)
+
+        # keys after the data keys are only used for the run level checks
+        Keys = self.DataText + ["Subject:", "PeriodDuration:"]
+        self.SubjectNo = self.NumFields
+        self.PeriodNo = self.NumFields + 1
+        if Spec.Baseline not in Keys:
+            Keys.append(Spec.Baseline)
+        self.BaselineNo = Keys.index(Spec.Baseline)
+        self.Keys = Keys
+        self.RunKeys = Keys[self.NumFields:]
+        if self.BaselineNo < self.NumFields:
+            self.RunKeys.append(Spec.Baseline)
+        self.Matcher = KeyMatcher(Keys, Spec.Exclude)
+
+        # transition table: Order[Pos] is the field expected at Pos, Opens[Pos]
+        # the deferred fields a trial waits on once Pos is stored
+        self.Order = [No for No, Field in enumerate(Spec.Fields)
+            if not Field.Deferred]
+        self.Opens = [[] for _ in self.Order]
+        for No, Field in enumerate(Spec.Fields):
+            if Field.Deferred:
+                Prev = [Pos for Pos, FieldNo in enumerate(self.Order) if FieldNo < No]
+                self.Opens[Prev[-1] if Prev else 0].append(No)
+        self.PosOf = [None] * self.NumFields
+        for Pos, FieldNo in enumerate(self.Order):
+            self.PosOf[FieldNo] = Pos
+
+        self.Trials = [[] for _ in Spec.States]
+        self.Ready = deque()
+        self.Pos = 0
+        self.Row = None
+        self.Last = None
+        self.Open = deque()
+        self.Waiting = {No: [] for No in range(self.NumFields)
+            if Spec.Fields[No].Deferred}
+        self.Seen = set()
+        self.TrialCounter = 1
+        self.FileParticipant = None
+        self.PeriodDurations = []
+        self.BaselineTime = None
+        self.Totals = None
+        if Spec.Aggregate is not None:
+            self.Totals = EprimeSummaries.Totals()
+
+    def Feed(self, Key, Value, LineNo):
+        TextNo = self.Matcher.Match(Key, Value)
+        if TextNo is None:
+            return
+        if TextNo == self.BaselineNo and self.BaselineTime is None:
+            self.BaselineTime = float(Value)
+        if TextNo < self.NumFields:
+            if self.PosOf[TextNo] is None:
+                self._Deferred(TextNo, Value, LineNo)
             else:
-                raise EndoParseError("* * * UNEXPECTED IDEA: {} * * *\n".format(tmp)
-                    + "Trial number: {}\n".format(TrialCounter)
-                    + "Line number : {}".format(Pairs[1]),
-                    Participant=Participant, InFile=FileName)
-            CurState = VerbalMemState.Case
-        elif CurState == VerbalMemState.Case:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            tmp = Pairs[0][ColLoc+1:].strip()
-            if tmp == "l":
-                Trials[CurState.value].append("Lower")
-            elif tmp == "u":
-                Trials[CurState.value].append("Upper")
+                self._Step(TextNo, Key, Value, LineNo)
+        else:
+            self._RunKey(TextNo, Value)
+
+    def FeedRun(self, Key, Value, LineNo):
+        """Feed only the run level attributes (Subject, PeriodDuration and
+        the baseline key, RunKeys), trial keys are skipped. See CheckRun."""
+        TextNo = self.Matcher.Match(Key, Value)
+        if TextNo is None:
+            return
+        if TextNo == self.BaselineNo and self.BaselineTime is None:
+            self.BaselineTime = float(Value)
+        if TextNo >= self.NumFields:
+            self._RunKey(TextNo, Value)
+
+    def CheckRun(self):
+        """Run the checks that only need the run level attributes:
+        participant, period durations and baseline."""
+        self._CheckParticipant()
+        Spec = self.Spec
+
+        # check for timings consistency
+        if (Spec.PeriodDurations is not None
+                and self.PeriodDurations != list(Spec.PeriodDurations)):
+            raise EndoParseError(
+                " * * * UNEXPECTED PERIOD DURATIONS * * *\n" +
+                "True period durations:     {}\n".format(Spec.PeriodDurations) +
+                "Expected period durations: {}".format(self.PeriodDurations),
+                Participant=self.Participant, InFile=self.FileName)
+
+        if self.BaselineTime is None:
+            raise EndoParseError(" * * * {} NOT FOUND * * *".format(
+                Spec.Baseline.rstrip(':')),
+                Participant=self.Participant, InFile=self.FileName)
+
+    def Finish(self):
+        self.CheckRun()
+        Spec = self.Spec
+        for No in self.Waiting:
+            if No not in self.Seen:
+                raise EndoParseError("* * * {} list EMPTY * * *".format(
+                    Spec.Fields[No].State.name),
+                    Participant=self.Participant, InFile=self.FileName)
+
+        if self.Pos != 0 or self.Open:
+            Expected = self.Order[self.Pos]
+            if self.Pos == 0:
+                Expected = [No for No in self.Waiting if self.Waiting[No]][0]
+            raise EndoParseError("Bad {} termination: {} {}".format(Spec.Name,
+                self.DataText[self.Order[0]], self.DataText[Expected]),
+                Participant=self.Participant, InFile=self.FileName)
+
+        return self.Trials
+
+    def _RunKey(self, TextNo, Value):
+        if TextNo == self.SubjectNo:
+            if self.FileParticipant is None:
+                self.FileParticipant = Value.lstrip('0')
+                self._CheckParticipant()
+        elif TextNo == self.PeriodNo:
+            self.PeriodDurations.append(int(Value))
+
+    def _CheckParticipant(self):
+        if self.FileParticipant != self.Participant:
+            raise EndoParseError(
+                " * * * PARTICIPANT MISMATCH * * *\n" +
+                "File Participant: {}".format(self.FileParticipant),
+                Participant=self.Participant, InFile=self.FileName)
+
+    def _Convert(self, TextNo, Value, LineNo):
+        Field = self.Spec.Fields[TextNo]
+        if Field.AllowNA and Value == "":
+            return "NA"
+        try:
+            return Field.Convert(Value)
+        except (ValueError, KeyError, IndexError):
+            raise EndoParseError("* * * UNEXPECTED {}: {} * * *\n".format(
+                Field.State.name.upper(), Value)
+                + "Trial number: {}\n".format(self.TrialCounter)
+                + "Line number : {}".format(LineNo),
+                Participant=self.Participant, InFile=self.FileName,
+                LineNo=LineNo)
+
+    def _Step(self, TextNo, Key, Value, LineNo):
+        if TextNo != self.Order[self.Pos]:
+            raise EndoTransitionError(LineNo,
+                "{}: {}".format(Key, Value).rstrip(),
+                self.DataText[self.Order[self.Pos]],
+                Participant=self.Participant, InFile=self.FileName)
+
+        if self.Pos == 0:
+            self.Row = [None] * len(self.Trials)
+            self.Open.append([self.Row, len(self.Waiting) + 1])
+        self.Row[self.Spec.Fields[TextNo].State.value] = self._Convert(
+            TextNo, Value, LineNo)
+        for No in self.Opens[self.Pos]:
+            self.Waiting[No].append(self.Open[-1])
+
+        self.Pos += 1
+        if self.Pos == len(self.Order):
+            self.Pos = 0
+            self._EndSequence(self.Open[-1])
+
+    def _Deferred(self, TextNo, Value, LineNo):
+        self.Seen.add(TextNo)
+        Value = self._Convert(TextNo, Value, LineNo)
+        State = self.Spec.Fields[TextNo].State.value
+        for Entry in self.Waiting[TextNo]:
+            Entry[0][State] = Value
+            Entry[1] -= 1
+        self.Waiting[TextNo] = []
+        self._Flush()
+
+    def _EndSequence(self, Entry):
+        Row = Entry[0]
+        for Rt, Resp in self.Spec.NALinks:
+            if Row[Resp.value] == "NA":
+                Row[Rt.value] = "NA"
+        Row[self.Spec.States.TrialNum.value] = self.TrialCounter
+        self.TrialCounter += 1
+        if self.Spec.OnTrial is not None:
+            self.Spec.OnTrial(self, Row)
+        self.Last = Row
+        Entry[1] -= 1
+        self._Flush()
+
+    def _Flush(self):
+        # trials are finished in file order
+        while self.Open and self.Open[0][1] == 0:
+            Row = self.Open.popleft()[0]
+            if self.Stream:
+                self.Ready.append(Row)
             else:
-                raise EndoParseError("* * * UNEXPECTED CASE: {} * * *\n".format(tmp)
-                    + "TrialNumber: {}\n".format(TrialCounter)
-                    + "Line number : {}".format(Pairs[1]),
-                    Participant=Participant, InFile=FileName)
-            CurState = VerbalMemState.Answer
-        elif CurState == VerbalMemState.Answer:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = VerbalMemState.Onset
-        elif CurState == VerbalMemState.Onset:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append((float(Pairs[0][ColLoc+1:].strip()) - BaselineTime) / 1000)
-            CurState = VerbalMemState.Acc
-        elif CurState == VerbalMemState.Acc:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = VerbalMemState.Rt
-        elif CurState == VerbalMemState.Rt:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(float(Pairs[0][ColLoc+1:].strip()) / 1000)
-            CurState = VerbalMemState.Resp
-        elif CurState == VerbalMemState.Resp:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            if ColLoc == len(Pairs[0]) - 1:
-                Trials[CurState.value].append("NA")
+                for Column, Value in zip(self.Trials, Row):
+                    Column.append(Value)
+            if self.Totals is not None:
+                Condition, Acc, Rt = self.Spec.Aggregate
+                self.Totals.Add((Row[Condition.value],), Row[Acc.value],
+                    Row[Rt.value])
+
+def ScaleRow(Spec, Row, BaselineTime):
+    """Convert the ms times of a raw trial row to s, relative to
+    BaselineTime, like TrialColumns.FromTrials does for whole columns."""
+    for Field in Spec.Fields:
+        if Field.Scale and Row[Field.State.value] != "NA":
+            Offset = BaselineTime if Field.Baseline else 0
+            Row[Field.State.value] = (Row[Field.State.value] - Offset) / 1000
+    return Row
+
+def RunMachine(Spec, FileName, Participant, Run=None, Corrections=(),
+        Reader=ReadAttributes, Profile=None):
+    """Feed one eprime file through a TrialMachine and return it finished.
+    Corrections are (Old, New) line fixes, see FileCorrections. Reader is
+    ReadAttributes or ScanAttributes (memory mapped, only the task keys).
+    A ParseProfile.FileProfile gets the read, scan and machine phases."""
+    Machine = TrialMachine(Spec, FileName, Participant, Run)
+    Attributes = Reader(FileName, Machine.Keys, Corrections)
+    if Profile is not None:
+        Profile.Read()
+        Profile.Run(Machine, Attributes)
+        return Machine
+    for Key, Value, LineNo in Attributes:
+        Machine.Feed(Key, Value, LineNo)
+    Machine.Finish()
+    return Machine
+
+def IterTask(Spec, FileName, Participant, Run=None, Corrections=(),
+        Reader=ReadAttributes):
+    """Yield every trial of one eprime file as soon as its last key (e.g. a
+    deferred Run{N}Lists) is read, as a Spec.Record (e.g. VerbalTrial) with
+    times scaled like ScaleRow.
+
+    The run level checks (period durations, termination) are done after
+    the last trial, a parse error can come after trials were yielded.
+    Stopping early closes the eprime file.
+    """
+    Machine = TrialMachine(Spec, FileName, Participant, Run, Stream=True)
+    for Key, Value, LineNo in Reader(FileName, Machine.Keys, Corrections):
+        Machine.Feed(Key, Value, LineNo)
+        # trials before the baseline key wait for it
+        while Machine.Ready and Machine.BaselineTime is not None:
+            yield Spec.Record(ScaleRow(Spec, Machine.Ready.popleft(),
+                Machine.BaselineTime))
+    Machine.Finish()
+    while Machine.Ready:
+        yield Spec.Record(ScaleRow(Spec, Machine.Ready.popleft(),
+            Machine.BaselineTime))
+
+def PreCheck(Spec, FileName, Participant, Run=None, Corrections=()):
+    """Run TrialMachine.CheckRun (participant, PeriodDuration sequence,
+    baseline key) without parsing the trials.
+
+    The whole file is scanned with ScanAttributes for the run level keys
+    only (TrialMachine.RunKeys), so the complete PeriodDuration sequence is
+    checked, including period frames logged after the trials of nested
+    lists and surplus frames. Raises EndoParseError.
+    """
+    Machine = TrialMachine(Spec, FileName, Participant, Run)
+    for Key, Value, LineNo in ScanAttributes(FileName, Machine.RunKeys,
+            Corrections):
+        Machine.FeedRun(Key, Value, LineNo)
+    Machine.CheckRun()
+
+def ParseTask(Spec, FileName, Participant, Run=None, Corrections=(),
+        Reader=ReadAttributes):
+    """Return the trials of one eprime file as TrialColumns, times in s
+    like IterTask."""
+    Machine = RunMachine(Spec, FileName, Participant, Run, Corrections, Reader)
+    return TrialColumns.FromTrials(Spec, Machine.Trials, Machine.BaselineTime)
+
+def TrialRecords(Spec, Trials):
+    """Return the TrialColumns Trials (e.g. of ParseRun) as a list of
+    Spec.Record, "NA" for missing values like IterTask."""
+    Columns = [["NA" if Value is None else Value
+        for Value in Trials.Values(State)] for State in Spec.States]
+    return [Spec.Record(Row) for Row in zip(*Columns)]
+
+def IterVerbalMem(FileName, Participant, Run, Corrections=(),
+        Reader=ReadAttributes):
+    return IterTask(VerbalMemSpec, FileName, Participant, Run, Corrections,
+        Reader)
+
+def ParseVerbalMem(FileName, Participant, Run, Corrections=(),
+        Reader=ReadAttributes):
+    return ParseTask(VerbalMemSpec, FileName, Participant, Run, Corrections,
+        Reader)
+
+# decimals of the scaled (s) columns in the csv files
+Precision = 3
+
+def CsvHeader(Columns):
+    return ",".join(Header for Header, _ in Columns) + "\n"
+
+def FormatRuns(Spec, Columns, RunTrials, **Constants):
+    """Return the csv lines of each run of one participant as one string.
+
+    Columns are (Header, Source) pairs, Source is a state of Spec or the
+    name of one of Constants or Run. Each run is formatted column wise,
+    scaled columns with Precision decimals.
+    """
+    Scaled = {Field.State for Field in Spec.Fields if Field.Scale}
+    Fixed = "{{:.{}f}}".format(Precision).format
+    Texts = []
+    for RunNum, Trials in enumerate(RunTrials, 1):
+        NumTrials = len(Trials)
+        Values = dict(Constants, Run=RunNum)
+        Cells = []
+        for Header, Source in Columns:
+            if isinstance(Source, str):
+                Cells.append(repeat(str(Values[Source]), NumTrials))
+            elif Source in Scaled:
+                Cells.append(["NA" if Value != Value else Fixed(Value)
+                    for Value in Trials[Source].tolist()])
             else:
-                Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = VerbalMemState.Dur
-        elif CurState == VerbalMemState.Dur:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(float(Pairs[0][ColLoc+1:].strip()) / 1000)
-            CurState = VerbalMemState.FixOnset
-        elif CurState == VerbalMemState.FixOnset:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append((float(Pairs[0][ColLoc+1:].strip()) - BaselineTime) / 1000)
-            CurState = VerbalMemState.RunLists
-        elif CurState == VerbalMemState.RunLists:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[VerbalMemState.RunLists.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            Trials[VerbalMemState.TrialNum.value].append(TrialCounter)
-            TrialCounter += 1
-            CurState = VerbalMemState.Stim
-
-    if CurState != VerbalMemState.Stim:
-        raise EndoParseError("Bad verbal Termination: {} {}".format(
-            DataText[VerbalMemState.Stim], DataText[CurState.value]),
-            Participant=Participant, InFile=FileName)
-
-    # let's do a check for reaction times
-    for i in range(len(Trials[0])):
-        if Trials[VerbalMemState.Resp.value][i] == "NA":
-            Trials[VerbalMemState.Rt.value][i] = "NA"
+                Cells.append(["NA" if Value is None else str(Value)
+                    for Value in Trials.Values(Source)])
+        Texts.append("".join(",".join(Row) + "\n" for Row in zip(*Cells)))
+    return Texts
 
-    return Trials
+def WriteShort(OutFile, Spec, Columns, RunTrials, **Constants):
+    """Write the trials of all runs of one participant to OutFile, see
+    FormatRuns. Returns the lines of each run."""
+    Texts = FormatRuns(Spec, Columns, RunTrials, **Constants)
+    with open(OutFile, 'w', buffering=1 << 20) as Out:
+        Out.write(CsvHeader(Columns))
+        Out.writelines(Texts)
+    return Texts
+
+VerbalMemColumns = [
+    ("Participant", "Participant"),
+    ("VerbalType", "VerbalType"),
+    ("Run", "Run"),
+    ("TrialNum", VerbalMemState.TrialNum),
+    ("Block", VerbalMemState.RunLists),
+    ("BlockType", VerbalMemState.Condition),
+    ("Stimulus", VerbalMemState.Stim),
+    ("Idea", VerbalMemState.Abst),
+    ("Case", VerbalMemState.Case),
+    ("Onset", VerbalMemState.Onset),
+    ("Acc", VerbalMemState.Acc),
+    ("RT", VerbalMemState.Rt),
+    ("Response", VerbalMemState.Resp),
+    ("CResponse", VerbalMemState.Answer),
+    ("TrialDuration", VerbalMemState.Dur),
+    ("FixOnset", VerbalMemState.FixOnset),
+]
+
+def VerbalType(Task):
+    if Task == "VerbalMemA":
+        return "A"
+    elif Task == "VerbalMemB":
+        return "B"
+    else:
+        # this case should never happen
+        raise EndoError()
 
 def PrintVerbalMemShort(OutFile, RunTrials, Participant, Task):
-    with open(OutFile, 'w') as Out:
-        # print header
-        print("Participant,"     # 1
-              "VerbalType,"     # 2
-              "Run,"     # 3
-              "TrialNum,"     # 4
-              "Block,"     # 5
-              "BlockType,"     # 6
-              "Stimulus,"     # 7
-              "Idea,"     # 8
-              "Case,"     # 9
-              "Onset,"     # 10
-              "Acc,"     # 11
-              "RT,"     # 12
-              "Response,"     # 13
-              "CResponse,"     # 14
-              "TrialDuration,"     # 15
-              "FixOnset", file=Out)     # 16
-
-        if Task == "VerbalMemA":
-            Type = "A"
-        elif Task == "VerbalMemB":
-            Type = "B"
-        else:
-            # this case should never happen
-            raise EndoError()
-
-        # print out data
-        for RunNum, Trials in enumerate(RunTrials, 1):
-            for Idx in range(len(Trials[0])):
-                print("{},".format(Participant)   #1
-                      + "{},".format(Type)   #2
-                      + "{},".format(RunNum)   #3
-                      + "{},".format(Trials[12][Idx])   #4
-                      + "{},".format(Trials[11][Idx])   #5
-                      + "{},".format(Trials[1][Idx])   #6
-                      + "{},".format(Trials[0][Idx])   #7
-                      + "{},".format(Trials[2][Idx])   #8
-                      + "{},".format(Trials[3][Idx])   #9
-                      + "{},".format(Trials[5][Idx])   #10
-                      + "{},".format(Trials[6][Idx])   #11
-                      + "{},".format(Trials[7][Idx])   #12
-                      + "{},".format(Trials[8][Idx])   #13
-                      + "{},".format(Trials[4][Idx])   #14
-                      + "{},".format(Trials[9][Idx])   #15
-                      + "{}".format(Trials[10][Idx]), file=Out)   #16
-
-def ParseEmotional(FileName, Participant):
+    WriteShort(OutFile, VerbalMemSpec, VerbalMemColumns, RunTrials,
+        Participant=Participant, VerbalType=VerbalType(Task))
+
+def IterEmotional(FileName, Participant, Corrections=(),
+        Reader=ReadAttributes):
+    return IterTask(EmotionalSpec, FileName, Participant,
+        Corrections=Corrections, Reader=Reader)
+
+def ParseEmotional(FileName, Participant, Corrections=(),
+        Reader=ReadAttributes):
     # let's assume the first trial is "baseline (time = 0)"
     # this is a reasonable guess because from Run5-037 we have
     # volumes = (80 * 2) = 160
@@ -367,196 +682,39 @@ def ParseEmotional(FileName, Participant):
     # StartScanner.OnsetTime = 16453
     # (190525 - 30530)/1000 = 159.995
     # (190525 - 16453)/1000 = 174.072
-    DataText = [
-        "MyImage:",
-        "MyAnswer:",
-        "Answer:",
-        "ImageDisplay1.OnsetTime:",
-        "ImageDisplay1.Duration:",
-        "ImageDisplay1.ACC:",
-        "ImageDisplay1.RT:",
-        "ImageDisplay1.RESP:",
-        "ShortDelay.OnsetTime:",
-        "ShortDelay.Duration:",
-        "ShortDelay.RT:",
-        "ShortDelay.RESP:"
-    ]
-
-    Trials = [[] for _ in range(EmotionalState.Block.value + 1)]
+    return ParseTask(EmotionalSpec, FileName, Participant,
+        Corrections=Corrections, Reader=Reader)
 
-    # read all lines
-    Lines = []
-    with open(FileName, 'r') as F:
-        for Line in F:
-            Lines.append(Line.strip())
-
-    # check subject is same as input
-    for Line in Lines:
-        if "Subject:" in Line:
-            ColIdx = Line.find(':')
-            FileParticipant = Line[ColIdx+1:].strip().lstrip('0')
-            break
-    if FileParticipant != Participant:
-        raise EndoParseError(
-            " * * * PARTICIPANT MISMATCH * * *\n" 
-            + "File Participant: {}".format(FileParticipant),
-            Participant=Participant, InFile=FileName)
-
-    # find baseline time
-    BaselineTime = -1
-    for Line in Lines:
-        if "ImageDisplay1.OnsetTime" in Line:
-            ColIdx = Line.find(':')
-            BaselineTime = float(Line[ColIdx+1:].strip())
-            break
-    if BaselineTime == -1:
-        raise EndoParseError(" * * * ImageDisplay1.OnsetTime NOT FOUND * * *",
-            Participant=Participant, InFile=FileName)
-
-    # grab data lines
-    DataLines = []
-    BlockIndex = 0
-    for LineNo, Line in enumerate(Lines):
-        for TextNo, OneText in enumerate(DataText):
-            if OneText in Line:
-                DataLines.append((Line, LineNo+1))
-                break
-
-    CurState = EmotionalState.ImageDis
-    TrialCounter = 1
-    BlockCounter = 1
-    for Pairs in DataLines:
-        if CurState == EmotionalState.ImageDis:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(Pairs[0][ColLoc+1:].strip())
-            CurState = EmotionalState.MyAnswer
-        elif CurState == EmotionalState.MyAnswer:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = EmotionalState.ImageAns
-        elif CurState == EmotionalState.ImageAns:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(Pairs[0][ColLoc+1:].strip())
-            if TrialCounter != 1:
-                tmp = Trials[CurState.value]
-                if tmp[TrialCounter-1] != tmp[TrialCounter-2]:
-                    BlockCounter += 1
-            CurState = EmotionalState.ImageOnset
-        elif CurState == EmotionalState.ImageOnset:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append((float(Pairs[0][ColLoc+1:]) - BaselineTime) / 1000)
-            CurState = EmotionalState.ImageDur
-        elif CurState == EmotionalState.ImageDur:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(float(Pairs[0][ColLoc+1:])/1000)
-            CurState = EmotionalState.ImageAcc
-        elif CurState == EmotionalState.ImageAcc:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:]))
-            CurState = EmotionalState.ImageRt
-        elif CurState == EmotionalState.ImageRt:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(float(Pairs[0][ColLoc+1:])/1000)
-            CurState = EmotionalState.ImageResp
-        elif CurState == EmotionalState.ImageResp:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            if ColLoc == len(Pairs[0]) - 1:
-                Trials[CurState.value].append("NA")
-            else:
-                Trials[CurState.value].append(int(Pairs[0][ColLoc+1:]))
-            CurState = EmotionalState.DelayOnset
-        elif CurState == EmotionalState.DelayOnset:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append((float(Pairs[0][ColLoc+1:]) - BaselineTime) / 1000)
-            CurState = EmotionalState.DelayDur
-        elif CurState == EmotionalState.DelayDur:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(float(Pairs[0][ColLoc+1:])/1000)
-            CurState = EmotionalState.DelayRt
-        elif CurState == EmotionalState.DelayRt:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(float(Pairs[0][ColLoc+1:])/1000)
-            Trials[EmotionalState.TrialNum.value].append(TrialCounter)
-            TrialCounter += 1
-            Trials[EmotionalState.Block.value].append(BlockCounter)
-            CurState = EmotionalState.DelayResp
-        elif CurState == EmotionalState.DelayResp:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            if ColLoc == len(Pairs[0]) - 1:
-                Trials[CurState.value].append("NA")
-            else:
-                Trials[CurState.value].append(int(Pairs[0][ColLoc+1:]))
-            CurState = EmotionalState.ImageDis
-        
-    if CurState != EmotionalState.ImageDis:
-        raise EndoParseError("Bad emotional Termination: {} {}".format(
-            DataText[EmotionalState.ImageDis], DataText[CurState.value]),
-            Participant=Participant, InFile=FileName)
-
-    for i in range(len(Trials[0])):
-        if Trials[EmotionalState.ImageResp.value][i] == "NA":
-            Trials[EmotionalState.ImageRt.value][i] = "NA"
+EmotionalColumns = [
+    ("Participant", "Participant"),
+    ("Run", "Run"),
+    ("TrialNum", EmotionalState.TrialNum),
+    ("Block", EmotionalState.Block),
+    ("ImageDis", EmotionalState.ImageDis),
+    ("ImageAnswer", EmotionalState.ImageAns),
+    ("ImageOnset", EmotionalState.ImageOnset),
+    ("ImageDur", EmotionalState.ImageDur),
+    ("ImageAcc", EmotionalState.ImageAcc),
+    ("ImageRt", EmotionalState.ImageRt),
+    ("ImageResp", EmotionalState.ImageResp),
+    ("ImageCresp", EmotionalState.MyAnswer),
+    ("DelayOnset", EmotionalState.DelayOnset),
+    ("DelayDur", EmotionalState.DelayDur),
+    ("DelayRt", EmotionalState.DelayRt),
+    ("DelayResp", EmotionalState.DelayResp),
+]
 
+def PrintEmotionalShort(OutFile, RunTrials, Participant):
+    WriteShort(OutFile, EmotionalSpec, EmotionalColumns, RunTrials,
+        Participant=Participant)
 
-    return Trials
+def IterVisualMem(FileName, Participant, Run, Corrections=(),
+        Reader=ReadAttributes):
+    return IterTask(VisualMemSpec, FileName, Participant, Run, Corrections,
+        Reader)
 
-def PrintEmotionalShort(OutFile, RunTrials, Participant):
-    with open(OutFile, "w") as Out:
-        # print header
-        print("Participant,Run,TrialNum,"
-            + "Block,ImageDis,ImageAnswer,"
-            + "ImageOnset,ImageDur,ImageAcc,"
-            + "ImageRt,ImageResp,ImageCresp,"
-            + "DelayOnset,DelayDur,DelayRt,"
-            + "DelayResp", file=Out)
-
-        # print out data
-        for RunNum, Trials in enumerate(RunTrials, 1):
-            for Idx in range(len(Trials[0])):
-                print("{},{},{},".format(Participant, RunNum, Trials[12][Idx])
-                    + "{},{},{},".format(Trials[13][Idx], Trials[0][Idx], Trials[2][Idx])
-                    + "{},{},{},".format(Trials[3][Idx], Trials[4][Idx], Trials[5][Idx])
-                    + "{},{},{},".format(Trials[6][Idx], Trials[7][Idx], Trials[1][Idx])
-                    + "{},{},{},".format(Trials[8][Idx], Trials[9][Idx], Trials[10][Idx])
-                    + "{}".format(Trials[11][Idx]), file=Out)
-
-def ParseVisualMem(FileName, Participant, Run):
+def ParseVisualMem(FileName, Participant, Run, Corrections=(),
+        Reader=ReadAttributes):
     # 21 1
     # first onset: 52768
     # last onset:  409831
@@ -569,198 +727,431 @@ def ParseVisualMem(FileName, Participant, Run):
     #            313464 - 316335
     #            
     # this has period durations and RunLists
-    TruePeriodDurations = (40000, 40000, 40000, 40000, 40000, 40000, 40000, 40000, 40000)
+    return ParseTask(VisualMemSpec, FileName, Participant, Run, Corrections,
+        Reader)
 
-    DataText = [
-        "Task:",
-        "Answer:",
-        "MatchLocation:",
-        "Running:",
-        "Response.OnsetTime:",
-        "Response.OffsetTime:",
-        "Response.ACC:",
-        "Response.RT:",
-        "Response.RESP:",
-        "RunList{}:".format(Run)
-    ]
+VisualMemColumns = [
+    ("Participant", "Participant"),
+    ("Run", "Run"),
+    ("TrialNum", VisualMemState.TrialNum),
+    ("BlockNum", VisualMemState.RunLists),
+    ("Task", VisualMemState.Task),
+    ("MatchLocation", VisualMemState.MatchLocation),
+    ("Running", VisualMemState.Running),
+    ("ResponseOnset", VisualMemState.ResponseOnset),
+    ("ResponseOffset", VisualMemState.ResponseOffset),
+    ("ResponseAcc", VisualMemState.ResponseAcc),
+    ("ResponseRt", VisualMemState.ResponseRt),
+    ("ResponseResp", VisualMemState.ResponseResp),
+    ("ResponseCresp", VisualMemState.Answer),
+]
 
-    Trials = [[] for _ in range(VisualMemState.TrialNum.value + 1)]
+def PrintVisualMemShort(OutFile, RunTrials, Participant):
+    WriteShort(OutFile, VisualMemSpec, VisualMemColumns, RunTrials,
+        Participant=Participant)
 
-    # read all lines
-    Lines = []
-    with open(FileName, 'r') as F:
-        for Line in F:
-            Lines.append(Line.strip())
-
-    # check subject is same as input
-    for Line in Lines:
-        if "Subject:" in Line:
-            ColIdx = Line.find(':')
-            FileParticipant = Line[ColIdx+1:].strip().lstrip('0')
-            break
-    if FileParticipant != Participant:
-        raise EndoParseError(
-            " * * * PARTICIPANT MISMATCH * * *\n" +
-            "File Participant: {}".format(FileParticipant),
-            Participant=Participant, InFile=FileName)
-
-    # check for timings consistency
-    PeriodDurations = []
-    for Line in Lines:
-        if "PeriodDuration:" in Line:
-            ColIdx = Line.find(':')
-            PeriodDurations.append(int(Line[ColIdx+1:].strip()))
-    if PeriodDurations != list(TruePeriodDurations):
-        raise EndoParseError(
-            " * * * UNEXPECTED PERIOD DURATIONS * * *\n" +
-            "True period durations:     {}\n".format(TruePeriodDurations) +
-            "Expected period durations: {}".format(PeriodDurations),
-            Participant=Participant, InFile=FileName)
-
-    # find baseline time
-    BaselineTime = -1
-    for Line in Lines:
-        if "ClearScreen.OnsetTime:" in Line:
-            ColIdx = Line.find(':')
-            BaselineTime = float(Line[ColIdx+1:].strip())
-            break
-    if BaselineTime == -1:
-        raise EndoVerbelParseError(" * * * ClearScreen.OnsetTime NOT FOUND * * *",
-            Participant=Participant, InFile=FileName)
-
-    # grab block lines  
-    BlockLines = []
-    for LineNo, Line in enumerate(Lines):
-        if DataText[VisualMemState.RunLists.value] in Line:
-            BlockLines.append((Line, LineNo+1))
-    if not BlockLines:
-        raise EndoParseError("* * * BlockLines list EMPTY * * *",
-            Participant=Participant, InFile=FileName)
+Tasks = ["Emotional", "VerbalMemA", "VerbalMemB", "VisualMem"]
 
-    # grab data lines
-    DataLines = []
-    BlockIndex = 0
-    for LineNo, Line in enumerate(Lines):
-        for TextNo, OneText in enumerate(DataText):
-            if (OneText in Line and "PeriodList" not in Line and
-                "IFISBlockList" not in Line):
-                if TextNo != VisualMemState.RunLists.value:
-                    DataLines.append((Line, LineNo+1))
-                else:
-                    BlockIndex += 1
-                if TextNo == VisualMemState.ResponseResp.value:
-                    DataLines.append(BlockLines[BlockIndex])
-                break
+# known errors in the eprime files, fixed while reading them:
+# (task, participant number, part of file name, old, new), None matches all
+Corrections = [
+    # trial 20 of VerbalMemA run 3 is labeled 1 instead of l
+    ("VerbalMemA", None, "Run3", "myCase: 1", "myCase: l"),
+    # participant 11 is labeled as 9 in the eprime files
+    (None, "11", None, "Subject: 009", "Subject: 011"),
+]
+
+def FileCorrections(Task, Number, FileName):
+    """Return the (Old, New) corrections of one eprime file."""
+    return [(Old, New) for OneTask, OneNumber, Part, Old, New in Corrections
+        if (OneTask is None or OneTask == Task)
+        and (OneNumber is None or OneNumber == Number)
+        and (Part is None or Part in os.path.basename(FileName))]
+
+def RunSpec(Task, RunNum):
+    """Return the TaskSpec of Task and the run number its keys need."""
+    if Task == "VerbalMemA" or Task == "VerbalMemB":
+        return VerbalMemSpec, RunNum
+    elif Task == "VisualMem":
+        return VisualMemSpec, RunNum
+    elif Task == "Emotional":
+        return EmotionalSpec, None
+
+def ParseRun(Task, Number, RunNum, FileName, Reader=ReadAttributes,
+        Profile=None):
+    """Parse one run of a task, Number is the participant without I0.
+    Returns the TrialColumns, the Totals of the run and, with a Profile
+    mode (see ParseProfile.Modes), its ParseProfile.FileProfile (else
+    None)."""
+    Fixes = FileCorrections(Task, Number, FileName)
+    Spec, Run = RunSpec(Task, RunNum)
+    if Profile is None:
+        Machine = RunMachine(Spec, FileName, Number, Run, Fixes, Reader)
+        return (TrialColumns.FromTrials(Spec, Machine.Trials,
+            Machine.BaselineTime), Machine.Totals, None)
+    ParseProfile.StartTracing(Profile)
+    Record = ParseProfile.FileProfile(FileName)
+    Machine = RunMachine(Spec, FileName, Number, Run, Fixes, Reader, Record)
+    with Record.Phase("scale"):
+        Trials = TrialColumns.FromTrials(Spec, Machine.Trials,
+            Machine.BaselineTime)
+    Record.Trials = len(Trials)
+    return Trials, Machine.Totals, Record
+
+def SubmitRuns(Executor, Task, Participant, InFiles, Reader=ReadAttributes,
+        Profile=None):
+    """Return one callable per run, in run order, that gives its trials,
+    totals and profile (see ParseRun).
+    Runs are parsed on Executor or, without one, when called."""
+    Number = Participant.lstrip('I0')
+    Runs = []
+    for RunNum, OneFile in enumerate(InFiles, 1):
+        if Executor is None:
+            Runs.append(partial(ParseRun, Task, Number, RunNum, OneFile, Reader,
+                Profile))
+        else:
+            Runs.append(Executor.submit(ParseRun, Task, Number, RunNum,
+                OneFile, Reader, Profile).result)
+    return Runs
+
+def WriteParticipant(Task, Participant, RunTrials, OutFile, Dataset=None,
+        Parsed=None, RunTotals=(), Profile=None, Cohort=None, Store=None):
+    """Write the csv file and, with a ColumnarOutput.TrialDataset, the
+    typed columnar file of one participant and task. Parsed (a dict) gets
+    the EprimeSummaries.TaskTable and Totals (from the Totals of each run)
+    of the csv file. A ParseProfile.BatchProfile gets a csv record with the
+    write, dataset, cohort, sqlite and tables phases. The runs also replace
+    those of the participant in a CohortOutput.CohortData and a
+    SqliteOutput.TrialStore."""
+    os.makedirs(os.path.dirname(os.path.abspath(OutFile)), exist_ok=True)
+    Record = None
+    if Profile is not None:
+        Record = Profile.Add(ParseProfile.FileProfile(OutFile, "csv"), Task,
+            Participant)
+    Constants = {"Participant": Participant}
+    if Task == "VerbalMemA" or Task == "VerbalMemB":
+        Spec, Columns = VerbalMemSpec, VerbalMemColumns
+        Constants["VerbalType"] = VerbalType(Task)
+    elif Task == "VisualMem":
+        Spec, Columns = VisualMemSpec, VisualMemColumns
+    elif Task == "Emotional":
+        Spec, Columns = EmotionalSpec, EmotionalColumns
+    with ParseProfile.Phase(Record, "write"):
+        Texts = WriteShort(OutFile, Spec, Columns, RunTrials, **Constants)
+    if Record is not None:
+        Record.Bytes = os.path.getsize(OutFile)
+        Record.Trials = sum(len(Trials) for Trials in RunTrials)
+    if Cohort is not None:
+        with ParseProfile.Phase(Record, "cohort"):
+            Cohort.Write(Task, CsvHeader(Columns), Participant, Texts)
+    if Store is not None:
+        with ParseProfile.Phase(Record, "sqlite"):
+            Store.Write(Task, Spec, Columns, RunTrials, **Constants)
+    if Dataset is not None:
+        with ParseProfile.Phase(Record, "dataset"):
+            Dataset.Write(Task, Participant,
+                ColumnarOutput.ToTable(Spec, Columns, RunTrials, **Constants))
+    if Parsed is not None:
+        First = [Constants[Name] for Name in EprimeSummaries.SpecOf(Task).First]
+        with ParseProfile.Phase(Record, "tables"):
+            Totals = EprimeSummaries.Totals()
+            for RunNum, OneTotals in enumerate(RunTotals, 1):
+                Totals.AddRun(Participant, RunNum, OneTotals, First)
+            Parsed[os.path.abspath(OutFile)] = (
+                EprimeSummaries.TaskTable.FromTrials(Spec, Columns, RunTrials,
+                **Constants), Totals)
+
+def ParseParticipant(Task, Participant, InFiles, OutFile, Executor=None,
+        Reader=ReadAttributes, Dataset=None, Profile=None, Cohort=None,
+        Store=None):
+    """Parse the eprime files of one participant and task, one file per run
+    in run order, and write them to OutFile. Participant is the directory
+    name, e.g. I00020. Profile is a ParseProfile.BatchProfile."""
+    Runs = SubmitRuns(Executor, Task, Participant, InFiles, Reader,
+        None if Profile is None else Profile.Mode)
+    Results = [Run() for Run in Runs]
+    if Profile is not None:
+        for _, _, Record in Results:
+            Profile.Add(Record, Task, Participant)
+    WriteParticipant(Task, Participant, [Trials for Trials, _, _ in Results],
+        OutFile, Dataset, Profile=Profile, Cohort=Cohort, Store=Store)
+
+# errors of a bad or unreadable eprime file, a batch goes on with the next
+# participant and task. OverflowError is a value out of the range of its
+# TrialColumns type, e.g. an accuracy of 200
+FileErrors = (EndoParseError, EndoTransitionError, OSError, UnicodeError,
+    ValueError, OverflowError)
+
+def PrintError(err, InFile=None):
+    if not isinstance(err, EndoError):
+        print(" * * * {} * * *\n".format(type(err).__name__.upper())
+            + "File       : {}\n".format(InFile)
+            + str(err), file=sys.stderr)
+    elif isinstance(err, EndoTransitionError):
+        print(" * * * TRANSITION ERROR * * *\n"
+            + "Participant: {}\n".format(err.Participant)
+            + "File       : {}\n".format(err.InFile)
+            + "LinNo      : {}\n".format(err.LineNo)
+            + "Found      : {}\n".format(err.FoundStr)
+            + "Expected   : {}".format(err.ExpectedStr), file=sys.stderr)
+    else:
+        print(" * * * PARSE ERROR * * *\n" 
+            + "Participant: {}\n".format(err.Participant)
+            + "File       : {}\n".format(err.InFile)
+            + err.Message, file=sys.stderr)
+
+def FinishRuns(Runs):
+    """Return the results of Runs, (InFile, callable) pairs as from
+    SubmitRuns, and None, or None and (error, InFile) of the first run
+    that failed with FileErrors."""
+    Results = []
+    for InFile, Run in Runs:
+        try:
+            Results.append(Run())
+        except FileErrors as err:
+            return None, (err, InFile)
+    return Results, None
+
+def RecordParse(Participant, Task, InFiles, OutFile, Failure=None, Cache=None,
+        Journal=None, Errors=None):
+    """Record a csv file written or, with Failure (error, file it happened
+    in), failed in the ParseCache, the ParseJournal and the Errors list."""
+    if Failure is None:
+        if Cache is not None:
+            Cache.Update(OutFile, InFiles)
+        if Journal is not None:
+            Journal.Record(Participant, Task, InFiles, OutFile)
+        return
+    err, InFile = Failure
+    PrintError(err, InFile)
+    if Cache is not None:
+        Cache.Remove(OutFile)
+    Error = ParseJournal.ErrorRecord(err, Participant, Task, InFile)
+    if Errors is not None:
+        Errors.append(Error)
+    if Journal is not None:
+        Journal.Record(Participant, Task, InFiles, OutFile, Error)
+
+def ListTaskDirs(Root):
+    """Yield (Participant, Task, InFiles, OutFile) for every
+    Root/<Participant>/<Task> directory that has eprime files."""
+    for OneDir in sorted(glob.glob(os.path.join(Root, '*', '*'))):
+        Participant = os.path.basename(os.path.dirname(OneDir))
+        Task = os.path.basename(OneDir)
+        InFiles = sorted(glob.glob(os.path.join(OneDir, '*txt')))
+        if Task not in Tasks or not os.path.isdir(OneDir) or not InFiles:
+            continue
+        OutFile = os.path.join(OneDir, "{}_{}.csv".format(Participant, Task))
+        yield Participant, Task, InFiles, OutFile
+
+def RawParticipant(FileName):
+    """Return the participant (e.g. I00020) of an original eprime file, the
+    second - separated field of its name, None without a number there."""
+    Fields = os.path.basename(FileName).split('-')
+    if len(Fields) < 2 or not Fields[1].isdecimal():
+        return None
+    return "I{:05d}".format(int(Fields[1]))
+
+def ListRawDirs(RawDir, OutDir):
+    """Yield (Participant, Task, InFiles, OutFile) for the original eprime
+    files in RawDir, OutFile is OutDir/<Participant>/<Task>/<...>.csv.
+    Files without a participant (see RawParticipant) are skipped with a
+    warning."""
+    for Task in Tasks:
+        # Emotional and Run are sometimes not separated by an underscore
+        ByParticipant = {}
+        for OneFile in sorted(glob.glob(os.path.join(RawDir, '*{}*txt'.format(Task)))):
+            Participant = RawParticipant(OneFile)
+            if Participant is None:
+                print("skipped {}: no participant number in the file "
+                    "name".format(OneFile), file=sys.stderr)
+                continue
+            ByParticipant.setdefault(Participant, []).append(OneFile)
+        for Participant, InFiles in ByParticipant.items():
+            OutFile = os.path.join(OutDir, Participant, Task,
+                "{}_{}.csv".format(Participant, Task))
+            yield Participant, Task, InFiles, OutFile
 
-    # do work here
-    CurState = VisualMemState.Task
-    TrialCounter = 1
-    for Pairs in DataLines:
-        if CurState == VisualMemState.Task:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = VisualMemState.Answer
-        elif CurState == VisualMemState.Answer:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = VisualMemState.MatchLocation
-        elif CurState == VisualMemState.MatchLocation:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(Pairs[0][ColLoc+1:].strip())
-            CurState = VisualMemState.Running
-        elif CurState == VisualMemState.Running:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(Pairs[0][ColLoc+1:].strip())
-            CurState = VisualMemState.ResponseOnset
-        elif CurState == VisualMemState.ResponseOnset:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append((float(Pairs[0][ColLoc+1:].strip()) - BaselineTime) / 1000)
-            CurState = VisualMemState.ResponseOffset
-        elif CurState == VisualMemState.ResponseOffset:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append((float(Pairs[0][ColLoc+1:].strip()) - BaselineTime) / 1000)
-            CurState = VisualMemState.ResponseAcc
-        elif CurState == VisualMemState.ResponseAcc:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = VisualMemState.ResponseRt
-        elif CurState == VisualMemState.ResponseRt:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(float(Pairs[0][ColLoc+1:].strip())/1000)
-            CurState = VisualMemState.ResponseResp
-        elif CurState == VisualMemState.ResponseResp:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            if ColLoc == len(Pairs[0]) - 1:
-                Trials[CurState.value].append("NA")
+def ConvertDirs(Dirs):
+    """Write UTF-8, corrected copies of the eprime files of Dirs (from
+    ListRawDirs) next to their csv files, existing copies are kept."""
+    for Participant, Task, InFiles, OutFile in Dirs:
+        OutDir = os.path.dirname(OutFile)
+        os.makedirs(OutDir, exist_ok=True)
+        for OneFile in InFiles:
+            Converted = os.path.join(OutDir, os.path.basename(OneFile))
+            if not os.path.exists(Converted):
+                ConvertFile(OneFile, Converted, FileCorrections(Task,
+                    Participant.lstrip('I0'), OneFile))
+
+def PreCheckDirs(Dirs):
+    """Run PreCheck on every run of Dirs, (Participant, Task, InFiles,
+    OutFile) as from ListTaskDirs or ListRawDirs, and print the errors.
+    Returns the number of runs checked and failed."""
+    Checked = Failed = 0
+    for Participant, Task, InFiles, _ in Dirs:
+        Number = Participant.lstrip('I0')
+        for RunNum, OneFile in enumerate(InFiles, 1):
+            Spec, Run = RunSpec(Task, RunNum)
+            Checked += 1
+            try:
+                PreCheck(Spec, OneFile, Number, Run,
+                    FileCorrections(Task, Number, OneFile))
+            except FileErrors as err:
+                Failed += 1
+                PrintError(err, OneFile)
+    return Checked, Failed
+
+def MakeExecutor(Jobs):
+    """Return a process pool for Jobs > 1, None to parse serially."""
+    return ProcessPoolExecutor(Jobs) if Jobs > 1 else None
+
+# modules whose code changes the csv files or the --dataset, --cohort and
+# --sqlite outputs, EprimeSummaries has the column kinds
+VersionModules = ["ParseEprimeEndopoid", "EprimeReader", "TrialColumns",
+    "EprimeSummaries", "ColumnarOutput", "CohortOutput", "SqliteOutput"]
+
+def ParserVersion():
+    """Changes whenever the parser or the code of one of its outputs
+    changes, see VersionModules."""
+    Here = os.path.dirname(os.path.abspath(__file__))
+    return HashSources([os.path.join(Here, Name + ".py")
+        for Name in VersionModules])
+
+def ParseRoot(Root, Jobs=1, Cache=None, Reader=ReadAttributes, Dataset=None,
+        Parsed=None, Profile=None, Journal=None, Errors=None, Resume=False,
+        Cohort=None, Store=None):
+    """Parse every participant and task directory under Root."""
+    with ParseProfile.Phase(Profile, "list"):
+        Dirs = list(ListTaskDirs(Root))
+    ParseDirs(Dirs, Jobs, Cache, Reader, Dataset, Parsed, Profile, Journal,
+        Errors, Resume, Cohort, Store)
+
+def HasOutputs(Task, Participant, Dataset=None, Cohort=None, Store=None):
+    """True if the optional outputs of a participant and task exist, so a
+    cached or done directory can be skipped."""
+    return ((Dataset is None or Dataset.Exists(Task, Participant))
+        and (Cohort is None or Cohort.Exists(Task, Participant))
+        and (Store is None or Store.Exists(Task, Participant)))
+
+def ParseDirs(Dirs, Jobs=1, Cache=None, Reader=ReadAttributes, Dataset=None,
+        Parsed=None, Profile=None, Journal=None, Errors=None, Resume=False,
+        Cohort=None, Store=None):
+    """Parse every (Participant, Task, InFiles, OutFile) of Dirs, a parse
+    error only skips the directory it happened in. With Jobs > 1 all runs
+    are parsed in a process pool, csv files are still written in order.
+    With a ParseCache only directories whose runs or parser changed are
+    parsed. A Dataset also gets a typed columnar file of every directory, a
+    CohortOutput.CohortData and a SqliteOutput.TrialStore the rows of every
+    directory.
+    Parsed gets the table of every csv file written, see WriteParticipant.
+    A ParseProfile.BatchProfile gets the profile of every file.
+
+    A bad or unreadable file (FileErrors) only drops its csv. A
+    ParseJournal gets a line for every csv written or failed, Errors (a
+    list) the ParseJournal.ErrorRecord of every failure. With Resume, the
+    directories that are done in the Journal are skipped."""
+    Executor = MakeExecutor(Jobs)
+    try:
+        ToParse = []
+        for Participant, Task, InFiles, OutFile in Dirs:
+            if (Cache is not None and Cache.IsCurrent(OutFile, InFiles)
+                    and HasOutputs(Task, Participant, Dataset, Cohort, Store)):
+                print("{} {} (cached)".format(Participant, Task))
+            elif (Resume and Journal.IsDone(OutFile)
+                    and HasOutputs(Task, Participant, Dataset, Cohort, Store)):
+                print("{} {} (done)".format(Participant, Task))
             else:
-                Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            CurState = VisualMemState.RunLists
-        elif CurState == VisualMemState.RunLists:
-            if DataText[CurState.value] not in Pairs[0]:
-                raise EndoTransitionError(Pairs[1], Pairs[0], DataText[CurState.value],
-                    Participant=Participant, InFile=FileName)
-            ColLoc = Pairs[0].find(":")
-            Trials[CurState.value].append(int(Pairs[0][ColLoc+1:].strip()))
-            Trials[VisualMemState.TrialNum.value].append(TrialCounter)
-            TrialCounter += 1
-            CurState = VisualMemState.Task
-
-    if CurState != VisualMemState.Task:
-        raise EndoParseError("Bad visual termination: {} {}".format(
-            DataText[VisualMemState.Task], DataText[CurState.value]),
-            Participant=Participant, InFile=FileName)
-
-    for i in range(len(Trials[0])):
-        if Trials[VisualMemState.ResponseResp.value][i] == "NA":
-            Trials[VisualMemState.ResponseRt.value][i] = "NA"
+                ToParse.append((Participant, Task, InFiles, OutFile))
+        Mode = None if Profile is None else Profile.Mode
+        Pending = [(Participant, Task, InFiles, OutFile,
+            list(zip(InFiles, SubmitRuns(Executor, Task, Participant, InFiles,
+            Reader, Mode)))) for Participant, Task, InFiles, OutFile in ToParse]
+        for Participant, Task, InFiles, OutFile, Runs in Pending:
+            print("{} {}".format(Participant, Task))
+            Results, Failure = FinishRuns(Runs)
+            if Failure is None:
+                try:
+                    if Profile is not None:
+                        for _, _, Record in Results:
+                            Profile.Add(Record, Task, Participant)
+                    WriteParticipant(Task, Participant,
+                        [Trials for Trials, _, _ in Results], OutFile, Dataset,
+                        Parsed, [Totals for _, Totals, _ in Results], Profile,
+                        Cohort, Store)
+                except FileErrors as err:
+                    Failure = (err, OutFile)
+            RecordParse(Participant, Task, InFiles, OutFile, Failure, Cache,
+                Journal, Errors)
+    finally:
+        if Executor is not None:
+            Executor.shutdown(cancel_futures=True)
+        if Cache is not None:
+            Cache.Save()
 
-    return Trials
+def Snapshot(InFiles):
+    """Return the (file, size, mtime) of every file, None when one of them
+    is gone."""
+    try:
+        return tuple((OneFile, Stat.st_size, Stat.st_mtime)
+            for OneFile, Stat in zip(InFiles, map(os.stat, InFiles)))
+    except FileNotFoundError:
+        return None
+
+def WatchRaw(RawDir, OutDir, Interval=60, Settle=30, Jobs=1, Cache=None,
+        Reader=ReadAttributes, Dataset=None, Summaries=None, Convert=False,
+        Polls=None, Cohort=None, Store=None, OnsetDir=None, Template=None,
+        Journal=None, Errors=None, Resume=False):
+    """Poll RawDir every Interval seconds and parse the participants and
+    tasks with new or changed runs, like --raw does for all of them.
+
+    A run is only parsed once it settled: two polls in a row found the same
+    size and mtime and it was last modified at least Settle seconds ago, so
+    files still being copied are left for a later poll. After each parse
+    the Summaries and OnsetDir (OnsetQC.WriteOnsetQC with Template, the
+    TaskTable of TaskTemplates.csv) directories are rewritten, the tables of
+    all csv files are kept between polls so only changed participants are
+    read again. Journal and Errors are as for
+    ParseDirs, Resume only applies to the first poll.
+    Stops after Polls polls, runs until interrupted without.
+    """
+    Done = {}
+    Seen = {}
+    # tables of the csv files, only kept for the summaries and onset QC
+    Parsed = {} if Summaries is not None or OnsetDir is not None else None
+    Poll = 0
+    while Polls is None or Poll < Polls:
+        if Poll > 0:
+            time.sleep(Interval)
+        Poll += 1
+        Now = time.time()
+        Ready = []
+        for Participant, Task, InFiles, OutFile in ListRawDirs(RawDir, OutDir):
+            Files = Snapshot(InFiles)
+            if Files is None or Done.get(OutFile) == Files:
+                continue
+            # a run seen for the first time waits for the next poll
+            Previous = Seen.get(OutFile)
+            Seen[OutFile] = Files
+            if Previous == Files and all(Now - Mtime >= Settle
+                    for _, _, Mtime in Files):
+                Ready.append((Participant, Task, InFiles, OutFile))
+        if not Ready:
+            continue
+        if Convert:
+            ConvertDirs(Ready)
+        ParseDirs(Ready, Jobs, Cache, Reader, Dataset, Parsed, None, Journal,
+            Errors, Resume and Poll == 1, Cohort, Store)
+        # failed parses are only tried again when one of their runs changes
+        for _, _, _, OutFile in Ready:
+            Done[OutFile] = Seen.pop(OutFile)
+        if Summaries is not None:
+            EprimeSummaries.WriteSummaries(OutDir, Summaries, Parsed)
+        if OnsetDir is not None:
+            OnsetQC.PrintOnsetQC(OnsetQC.WriteOnsetQC(OutDir, OnsetDir,
+                Template, Parsed))
+        sys.stdout.flush()
 
-def PrintVisualMemShort(OutFile, RunTrials, Participant):
-    with open(OutFile, "w") as Out:
-        # print header first
-        print("Participant,Run,TrialNum,"
-            + "BlockNum,Task,MatchLocation,"
-            + "Running,ResponseOnset,ResponseOffset,"
-            + "ResponseAcc,ResponseRt,ResponseResp,"
-            + "ResponseCresp", file=Out)
-
-        # now print out data
-        for RunNum, Trials in enumerate(RunTrials, 1):
-            for Idx in range(len(Trials[0])):
-                print("{},{},{},".format(Participant, RunNum, Trials[10][Idx])
-                    + "{},{},{},".format(Trials[9][Idx], Trials[0][Idx], Trials[2][Idx])
-                    + "{},{},{},".format(Trials[3][Idx], Trials[4][Idx], Trials[5][Idx])
-                    + "{},{},{},".format(Trials[6][Idx], Trials[7][Idx], Trials[8][Idx])
-                    + "{}".format(Trials[1][Idx]), file=Out)
-    
 def TestVerbalMem():
     try:
         FileName = '/home/heffjos/Documents/ForOthers/Endopoid/EprimeScripts/ConvertedEprime/I00020/VerbalMemA/endopoid_VerbalMemA_Run1-20-1.txt'
@@ -780,43 +1171,194 @@ def TestVerbalMem():
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Parse endopoid eprime files.')
-    parser.add_argument('--task', required=True, help="task for eprime files",
-        choices=["Emotional", "VerbalMemA", "VerbalMemB", "VisualMem"])
-    parser.add_argument('--participant', required=True, help="participant name")
-    parser.add_argument('--outfile', required=True, help="output csv file")
-    parser.add_argument('--infiles', required=True, help="input eprime files",
-        nargs='+')
+    parser.add_argument('--task', help="task for eprime files", choices=Tasks)
+    parser.add_argument('--participant', help="participant name")
+    parser.add_argument('--outfile', help="output csv file")
+    parser.add_argument('--infiles', help="input eprime files", nargs='+')
+    parser.add_argument('--root', help="parse every <root>/<participant>/<task> "
+        "directory (e.g. ./ConvertedEprime) instead of one participant")
+    parser.add_argument('--raw', help="parse the original (UTF-16) eprime "
+        "files in this directory (e.g. ./eprime), csv files go to --outdir")
+    parser.add_argument('--outdir', default="./ConvertedEprime",
+        help="output root for --raw (default ./ConvertedEprime)")
+    parser.add_argument('--convert', action='store_true', help="with --raw, "
+        "also write UTF-8 corrected copies of the eprime files to --outdir")
+    parser.add_argument('--mmap', action='store_true', help="memory map the "
+        "eprime files and only decode the lines of the task keys")
+    parser.add_argument('--jobs', type=int, default=1,
+        help="number of processes used to parse runs (default 1)")
+    parser.add_argument('--cache', help="parse cache manifest (json), csv "
+        "files are only rebuilt when a run or the parser changed")
+    parser.add_argument('--dataset', help="also write typed columnar files "
+        "to <dataset>/<task>/<participant>.<format> (needs pyarrow)")
+    parser.add_argument('--format', default="parquet",
+        choices=sorted(ColumnarOutput.Formats),
+        help="file format of --dataset (default parquet)")
+    parser.add_argument('--cohort', help="also add the rows of every "
+        "participant to one csv file per task, <cohort>/<task>.csv, runs "
+        "parsed again replace their old rows")
+    parser.add_argument('--sqlite', help="also write the rows of every "
+        "participant to this sqlite database, one table per task, runs "
+        "parsed again replace their old rows (see SqliteOutput.py)")
+    parser.add_argument('--summaries', help="with --root or --raw, also write "
+        "the run and participant summaries to this directory (e.g. "
+        "./EprimeSummaries), see EprimeSummaries.py")
+    parser.add_argument('--onsetqc', help="with --root or --raw, also check "
+        "the trial onsets of every run against --template and write "
+        "<Name>OnsetQC.csv to this directory, see OnsetQC.py")
+    parser.add_argument('--template', default="./TaskTemplates.csv",
+        help="task templates of --onsetqc (default ./TaskTemplates.csv)")
+    parser.add_argument('--profile', help="time every phase (read, scan, "
+        "machine, scale, write, ...) of every file, trace its peak memory "
+        "and write a json report to this file, a summary is printed at the end")
+    parser.add_argument('--profile-mode', default="memory",
+        choices=ParseProfile.Modes, help="with --profile, \"time\" skips "
+        "tracemalloc, which slows the scan down (default memory)")
+    parser.add_argument('--journal', help="with --root or --raw, append the "
+        "result of every participant and task to this checkpoint journal "
+        "(json lines)")
+    parser.add_argument('--resume', action='store_true', help="with "
+        "--journal, only parse what failed or is missing in the journal")
+    parser.add_argument('--errors', help="with --root or --raw, write every "
+        "failure (participant, task, file, line, found, expected) to this "
+        "json file")
+    parser.add_argument('--check', action='store_true', help="with --root or "
+        "--raw, only check the participant, period durations and baseline "
+        "of every run, the files are scanned for those keys and no trials "
+        "are parsed (a quick QC sweep, nothing is written)")
+    parser.add_argument('--watch', action='store_true', help="with --raw, keep "
+        "polling the eprime directory and parse new or changed runs as they "
+        "arrive (stop with Ctrl-C)")
+    parser.add_argument('--interval', type=float, default=60,
+        help="seconds between polls of --watch (default 60)")
+    parser.add_argument('--settle', type=float, default=30,
+        help="--watch only parses runs unchanged for this many seconds, so "
+        "partially copied files are skipped (default 30)")
     args = parser.parse_args()
-    Participant = args.participant.lstrip('I0')
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    Dataset = None
+    if args.dataset is not None:
+        if ColumnarOutput.pa is None:
+            parser.error("--dataset needs pyarrow")
+        Dataset = ColumnarOutput.TrialDataset(args.dataset, args.format)
+    Reader = ScanAttributes if args.mmap else ReadAttributes
+    Cohort = None
+    if args.cohort is not None:
+        Cohort = CohortOutput.CohortData(args.cohort)
+    Store = None
+    if args.sqlite is not None:
+        Store = SqliteOutput.TrialStore(args.sqlite)
+    Cache = None
+    if args.cache is not None:
+        Cache = ParseCache(args.cache, ParserVersion())
 
-    try:
-        RunTrials = []
-        if args.task == "VerbalMemA" or args.task == "VerbalMemB":
-            for RunNum, OneFile in enumerate(args.infiles, 1):
-                RunTrials.append(ParseVerbalMem(OneFile, Participant, RunNum))
-            PrintVerbalMemShort(args.outfile, RunTrials, args.participant, args.task)
-        elif args.task == "VisualMem":
-            for RunNum, OneFile in enumerate(args.infiles, 1):
-                RunTrials.append(ParseVisualMem(OneFile, Participant, RunNum))
-            PrintVisualMemShort(args.outfile, RunTrials, args.participant)
-        elif args.task == "Emotional":
-            for RunNum, OneFile in enumerate(args.infiles, 1):
-                RunTrials.append(ParseEmotional(OneFile, Participant))
-            PrintEmotionalShort(args.outfile, RunTrials, args.participant)
-    except EndoParseError as err:
-        print(" * * * PARSE ERROR * * *\n" 
-            + "Participant: {}\n".format(err.Participant)
-            + "File       : {}\n".format(err.InFile)
-            + err.Message, file=sys.stderr)
-    except EndoTransitionError as err:
-        print(" * * * TRANSITION ERROR * * *\n"
-            + "Participant: {}\n".format(err.Participant)
-            + "File       : {}\n".format(err.InFile)
-            + "LinNo      : {}\n".format(err.LineNo)
-            + "Found      : {}\n".format(err.FoundStr)
-            + "Expected   : {}".format(err.ExpectedStr), file=sys.stderr)
-    except:
-        raise
+    if args.summaries is not None and args.raw is None and args.root is None:
+        parser.error("--summaries needs --root or --raw")
+    if args.onsetqc is not None and args.raw is None and args.root is None:
+        parser.error("--onsetqc needs --root or --raw")
+    # read before anything is parsed, so a missing template does not stop
+    # a batch or --watch after the work is done
+    Template = None
+    if args.onsetqc is not None:
+        if not os.path.isfile(args.template):
+            parser.error("--template {} not found".format(args.template))
+        Template = EprimeSummaries.TaskTable.FromCsv(args.template)
+    if args.resume and args.journal is None:
+        parser.error("--resume needs --journal")
+    # the tables of every csv file are only kept when a later stage reads
+    # them, a batch without it keeps nothing per participant
+    Parsed = {} if args.summaries or args.onsetqc else None
+    Journal = None
+    if args.journal is not None:
+        Journal = ParseJournal.ParseJournal(args.journal)
+    Errors = None if args.errors is None else []
+    Profile = None
+    if args.profile is not None:
+        Profile = ParseProfile.BatchProfile(args.profile_mode)
+
+    if args.check:
+        if args.raw is not None:
+            Dirs = ListRawDirs(args.raw, args.outdir)
+        elif args.root is not None:
+            Dirs = ListTaskDirs(args.root)
+        else:
+            parser.error("--check needs --root or --raw")
+        Checked, Failed = PreCheckDirs(Dirs)
+        print("{} of {} runs failed the checks".format(Failed, Checked))
+        sys.exit(1 if Failed else 0)
+    elif args.watch:
+        if args.raw is None:
+            parser.error("--watch needs --raw")
+        if Profile is not None:
+            parser.error("--profile cannot be used with --watch")
+        try:
+            WatchRaw(args.raw, args.outdir, args.interval, args.settle,
+                args.jobs, Cache, Reader, Dataset, args.summaries, args.convert,
+                Cohort=Cohort, Store=Store, OnsetDir=args.onsetqc,
+                Template=Template, Journal=Journal, Errors=Errors,
+                Resume=args.resume)
+        except KeyboardInterrupt:
+            pass
+    elif args.raw is not None:
+        with ParseProfile.Phase(Profile, "list"):
+            Dirs = list(ListRawDirs(args.raw, args.outdir))
+        if args.convert:
+            ConvertDirs(Dirs)
+        ParseDirs(Dirs, args.jobs, Cache, Reader, Dataset, Parsed, Profile,
+            Journal, Errors, args.resume, Cohort, Store)
+        if args.summaries is not None:
+            with ParseProfile.Phase(Profile, "summaries"):
+                EprimeSummaries.WriteSummaries(args.outdir, args.summaries,
+                    Parsed)
+        if args.onsetqc is not None:
+            with ParseProfile.Phase(Profile, "onsetqc"):
+                OnsetQC.PrintOnsetQC(OnsetQC.WriteOnsetQC(args.outdir,
+                    args.onsetqc, Template, Parsed))
+    elif args.root is not None:
+        ParseRoot(args.root, args.jobs, Cache, Reader, Dataset, Parsed, Profile,
+            Journal, Errors, args.resume, Cohort, Store)
+        if args.summaries is not None:
+            with ParseProfile.Phase(Profile, "summaries"):
+                EprimeSummaries.WriteSummaries(args.root, args.summaries,
+                    Parsed)
+        if args.onsetqc is not None:
+            with ParseProfile.Phase(Profile, "onsetqc"):
+                OnsetQC.PrintOnsetQC(OnsetQC.WriteOnsetQC(args.root,
+                    args.onsetqc, Template, Parsed))
+    elif not (args.task and args.participant and args.outfile and args.infiles):
+        parser.error("--task, --participant, --outfile and --infiles are "
+            "required without --root or --raw")
+    else:
+        Executor = MakeExecutor(args.jobs)
+        try:
+            if (Cache is None or not Cache.IsCurrent(args.outfile, args.infiles)
+                    or not HasOutputs(args.task, args.participant, Dataset,
+                    Cohort, Store)):
+                ParseParticipant(args.task, args.participant, args.infiles,
+                    args.outfile, Executor, Reader, Dataset, Profile, Cohort,
+                    Store)
+                if Cache is not None:
+                    Cache.Update(args.outfile, args.infiles)
+        except (EndoParseError, EndoTransitionError) as err:
+            PrintError(err)
+            if Cache is not None:
+                Cache.Remove(args.outfile)
+        finally:
+            if Executor is not None:
+                Executor.shutdown(cancel_futures=True)
+            if Cache is not None:
+                Cache.Save()
+    if Journal is not None:
+        Journal.Close()
+    if Store is not None:
+        Store.Close()
+    if Errors is not None:
+        ParseJournal.WriteErrors(args.errors, Errors)
+        print("{} failed, see {}".format(len(Errors), args.errors))
+    if Profile is not None:
+        Profile.Write(args.profile)
+        Profile.Print()
 
 def tmp():
     DataText = [
@@ -0,0 +1,70 @@
+import datetime
+import json
+import os
+
+def ErrorRecord(err, Participant, Task, InFile):
+    """Return the report entry of an error raised while parsing InFile.
+    LineNo, Found and Expected are None when the error has none."""
+    return {
+        "Participant": Participant,
+        "Task": Task,
+        "File": os.path.abspath(getattr(err, "InFile", None) or InFile),
+        "Error": type(err).__name__,
+        "LineNo": getattr(err, "LineNo", None),
+        "Found": getattr(err, "FoundStr", None),
+        "Expected": getattr(err, "ExpectedStr", None),
+        "Message": getattr(err, "Message", None) or str(err),
+    }
+
+def WriteErrors(FileName, Errors):
+    """Write the ErrorRecords of a batch as a json list."""
+    os.makedirs(os.path.dirname(os.path.abspath(FileName)), exist_ok=True)
+    with open(FileName, 'w') as F:
+        json.dump(Errors, F, indent=1)
+
+class ParseJournal:
+    """Checkpoint journal of a batch, one json line per parsed participant
+    and task, appended and flushed as soon as its csv is written or failed,
+    so it survives an interrupted batch. The last line of an output wins.
+
+    An output is done when its last line is "ok" and the csv exists, a
+    resumed batch only parses the outputs that failed or are missing.
+    """
+    def __init__(self, FileName):
+        self.FileName = FileName
+        self.Last = {}
+        if os.path.exists(FileName):
+            with open(FileName) as F:
+                for Line in F:
+                    # a line cut off by an interrupted batch is ignored
+                    try:
+                        Entry = json.loads(Line)
+                    except ValueError:
+                        continue
+                    self.Last[Entry["OutFile"]] = Entry
+        os.makedirs(os.path.dirname(os.path.abspath(FileName)), exist_ok=True)
+        self.Out = open(FileName, 'a')
+
+    def IsDone(self, OutFile):
+        Entry = self.Last.get(os.path.abspath(OutFile))
+        return (Entry is not None and Entry["Status"] == "ok"
+            and os.path.exists(OutFile))
+
+    def Record(self, Participant, Task, InFiles, OutFile, Error=None):
+        """Append the result of one output, Error is its ErrorRecord."""
+        Entry = {
+            "Time": datetime.datetime.now().isoformat(timespec='seconds'),
+            "Participant": Participant,
+            "Task": Task,
+            "OutFile": os.path.abspath(OutFile),
+            "InFiles": [os.path.abspath(OneFile) for OneFile in InFiles],
+            "Status": "ok" if Error is None else "failed",
+        }
+        if Error is not None:
+            Entry["Error"] = Error
+        self.Last[Entry["OutFile"]] = Entry
+        self.Out.write(json.dumps(Entry) + "\n")
+        self.Out.flush()
+
+    def Close(self):
+        self.Out.close()
@@ -0,0 +1,181 @@
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from EprimeReader import DetectEncoding
+
+# Phases of the parse, in the order they happen:
+# read -- reading the raw bytes of an eprime file (NFS)
+# scan -- decoding lines and finding the task keys (the Reader)
+# machine -- the TrialMachine, Feed and Finish
+# scale -- typed columns, ms to s and baseline subtraction
+#          (TrialColumns.FromTrials)
+# write -- the csv file of a participant and task
+# cohort, sqlite, dataset, tables -- the --cohort, --sqlite and --dataset
+#                                   outputs and the tables kept for
+#                                   --summaries
+# list, summaries, onsetqc -- once per batch
+Phases = ["list", "read", "scan", "machine", "scale", "write", "cohort",
+    "sqlite", "dataset", "tables", "summaries", "onsetqc"]
+
+# "memory" also traces the peak memory of every phase with tracemalloc,
+# which makes the parse (mostly the scan) a few times slower. "time" only
+# measures the wall time, PeakBytes stay 0.
+Modes = ["memory", "time"]
+
+def StartTracing(Mode):
+    if Mode == "memory" and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def ResetPeak():
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+def UpdatePeak(Phase):
+    if tracemalloc.is_tracing():
+        Phase["PeakBytes"] = max(Phase["PeakBytes"],
+            tracemalloc.get_traced_memory()[1])
+
+@contextmanager
+def Measure(Phases, Name):
+    """Add the wall time and the traced memory peak of the with block to
+    Phases[Name], a dict with Seconds and PeakBytes."""
+    Phase = Phases.setdefault(Name, {"Seconds": 0.0, "PeakBytes": 0})
+    ResetPeak()
+    Start = time.perf_counter()
+    try:
+        yield
+    finally:
+        Phase["Seconds"] += time.perf_counter() - Start
+        UpdatePeak(Phase)
+
+def Phase(Profile, Name):
+    """Profile.Phase(Name), nothing is measured without a Profile."""
+    return nullcontext() if Profile is None else Profile.Phase(Name)
+
+class FileProfile:
+    """Phase times and peak memory of one eprime (Kind "eprime") or output
+    (Kind "csv") file. Bytes are read for an eprime file and written for a
+    csv file. Records are plain data, so they come back from the process
+    pool with the trials."""
+    def __init__(self, FileName, Kind="eprime"):
+        self.FileName = os.path.abspath(FileName)
+        self.Kind = Kind
+        self.Task = None
+        self.Participant = None
+        self.Bytes = 0
+        self.Lines = 0
+        self.Attributes = 0
+        self.Trials = 0
+        self.Phases = {}
+
+    def Phase(self, Name):
+        return Measure(self.Phases, Name)
+
+    def Read(self):
+        """Read the whole file once (read phase) and count its lines. The
+        scan then reads it from the page cache, so read is the I/O alone."""
+        with self.Phase("read"):
+            with open(self.FileName, 'rb') as F:
+                Data = F.read()
+        Codec = DetectEncoding(self.FileName).replace('-sig', '')
+        if Codec == 'utf-16':
+            Codec = 'utf-16-be' if Data.startswith(b'\xfe\xff') else 'utf-16-le'
+        self.Bytes = len(Data)
+        self.Lines = Data.count('\n'.encode(Codec))
+
+    def Run(self, Machine, Attributes):
+        """Feed the (Key, Value, LineNo) Attributes of a Reader to Machine
+        and finish it. Reader and machine alternate on every attribute, both
+        are timed on their own, their common peak memory is under scan."""
+        Scan = self.Phases.setdefault("scan", {"Seconds": 0.0, "PeakBytes": 0})
+        Feed = self.Phases.setdefault("machine", {"Seconds": 0.0, "PeakBytes": 0})
+        Attributes = iter(Attributes)
+        ResetPeak()
+        while True:
+            Start = time.perf_counter()
+            Attribute = next(Attributes, None)
+            Scanned = time.perf_counter()
+            Scan["Seconds"] += Scanned - Start
+            if Attribute is None:
+                break
+            Machine.Feed(*Attribute)
+            Feed["Seconds"] += time.perf_counter() - Scanned
+            self.Attributes += 1
+        UpdatePeak(Scan)
+        with self.Phase("machine"):
+            Machine.Finish()
+
+    def ToDict(self):
+        return dict(vars(self))
+
+class BatchProfile:
+    """Collects the FileProfile of every file of a batch and the batch
+    level phases (list, summaries). Mode is one of Modes, the runs are
+    parsed with the same Mode (see ParseRun)."""
+    def __init__(self, Mode="memory"):
+        StartTracing(Mode)
+        self.Mode = Mode
+        self.Start = time.perf_counter()
+        self.Files = []
+        self.Phases = {}
+
+    def Phase(self, Name):
+        return Measure(self.Phases, Name)
+
+    def Add(self, Record, Task, Participant):
+        if Record is not None:
+            Record.Task = Task
+            Record.Participant = Participant
+            self.Files.append(Record)
+        return Record
+
+    def Summary(self):
+        """Return the totals of the batch: wall time, bytes, lines,
+        attributes and trials, and per phase the summed time, the highest
+        peak memory and the number of files."""
+        Summary = {"Mode": self.Mode,
+            "Seconds": time.perf_counter() - self.Start,
+            "Files": sum(Record.Kind == "eprime" for Record in self.Files),
+            "BytesRead": sum(Record.Bytes for Record in self.Files
+                if Record.Kind == "eprime"),
+            "BytesWritten": sum(Record.Bytes for Record in self.Files
+                if Record.Kind == "csv"),
+            "Lines": sum(Record.Lines for Record in self.Files),
+            "Attributes": sum(Record.Attributes for Record in self.Files),
+            "Trials": sum(Record.Trials for Record in self.Files
+                if Record.Kind == "eprime"),
+            "Phases": {}}
+        for Measured in [self.Phases] + [Record.Phases for Record in self.Files]:
+            for Name, One in Measured.items():
+                Total = Summary["Phases"].setdefault(Name,
+                    {"Seconds": 0.0, "PeakBytes": 0, "Files": 0})
+                Total["Seconds"] += One["Seconds"]
+                Total["PeakBytes"] = max(Total["PeakBytes"], One["PeakBytes"])
+                Total["Files"] += 1
+        Summary["Phases"] = {Name: Summary["Phases"][Name] for Name in Phases
+            if Name in Summary["Phases"]}
+        return Summary
+
+    def Write(self, FileName):
+        """Write the json report: the Summary and every file record."""
+        Report = {"Summary": self.Summary(),
+            "Files": [Record.ToDict() for Record in self.Files]}
+        with open(FileName, 'w') as F:
+            json.dump(Report, F, indent=1)
+
+    def Print(self, Out=sys.stdout):
+        Summary = self.Summary()
+        print("{} eprime files, {:.1f} MB read, {} lines, {} trials, "
+            "{:.1f} MB written in {:.2f} s".format(Summary["Files"],
+            Summary["BytesRead"] / 1e6, Summary["Lines"], Summary["Trials"],
+            Summary["BytesWritten"] / 1e6, Summary["Seconds"]), file=Out)
+        print("{:<10} {:>9} {:>6} {:>11}".format("Phase", "Seconds", "Files",
+            "Peak MB"), file=Out)
+        for Name, One in Summary["Phases"].items():
+            print("{:<10} {:>9.3f} {:>6} {:>11.2f}".format(Name,
+                One["Seconds"], One["Files"], One["PeakBytes"] / 1e6),
+                file=Out)
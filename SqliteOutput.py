@@ -0,0 +1,117 @@
+import argparse
+import csv
+import sqlite3
+import sys
+
+from EprimeSummaries import FieldKind
+
+# columns indexed in the table of each task, besides (Participant, Run)
+Indexes = {
+    "Emotional": ["Block", "ImageAnswer"],
+    "VerbalMemA": ["Block", "BlockType"],
+    "VerbalMemB": ["Block", "BlockType"],
+    "VisualMem": ["BlockNum", "Running"],
+}
+
+# sqlite type of each EprimeSummaries.FieldKind
+SqlTypes = {"double": "REAL", "integer": "INTEGER", "character": "TEXT"}
+
+def SqlType(Spec, Source):
+    """Return the sqlite type of a csv column, Source as in WriteShort."""
+    if Source == "Run":
+        return "INTEGER"
+    if isinstance(Source, str):
+        return "TEXT"
+    return SqlTypes[FieldKind(Spec, Source)]
+
+def Quote(Name):
+    return '"{}"'.format(Name)
+
+class TrialStore:
+    """SQLite database with a table per task holding the csv columns of the
+    parsed trials, "NA" as NULL and times in s at full precision.
+
+    Every run is replaced in its own transaction, so re-parsing a run only
+    touches its rows and readers never see a half written run.
+    """
+    def __init__(self, FileName):
+        self.Connection = sqlite3.connect(FileName)
+        # readers are not blocked while a batch writes
+        self.Connection.execute("PRAGMA journal_mode=WAL")
+        self.Connection.execute("PRAGMA synchronous=NORMAL")
+        self.Tables = {}
+
+    def Close(self):
+        self.Connection.close()
+
+    def Columns(self, Task):
+        return [Row[1] for Row in self.Connection.execute(
+            "PRAGMA table_info({})".format(Quote(Task)))]
+
+    def Table(self, Task, Spec, Columns):
+        """Create the table of Task with its indexes, a table with other
+        columns (e.g. of an older parser) is made again."""
+        Names = [Header for Header, _ in Columns]
+        if self.Tables.get(Task) == Names:
+            return
+        with self.Connection:
+            if self.Columns(Task) not in ([], Names):
+                self.Connection.execute("DROP TABLE {}".format(Quote(Task)))
+            self.Connection.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(
+                Quote(Task), ", ".join("{} {}".format(Quote(Header),
+                SqlType(Spec, Source)) for Header, Source in Columns)))
+            for Index in [["Participant", "Run"]] + Indexes.get(Task, []):
+                if isinstance(Index, str):
+                    Index = [Index]
+                self.Connection.execute(
+                    "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                    Quote("{}_{}".format(Task, "_".join(Index))), Quote(Task),
+                    ", ".join(map(Quote, Index))))
+        self.Tables[Task] = Names
+
+    def Exists(self, Task, Participant):
+        if not self.Columns(Task):
+            return False
+        return self.Connection.execute("SELECT 1 FROM {} WHERE Participant = ? "
+            "LIMIT 1".format(Quote(Task)), (Participant,)).fetchone() is not None
+
+    def Write(self, Task, Spec, Columns, RunTrials, **Constants):
+        """Replace the runs of the participant in the table of Task by
+        RunTrials (the TrialColumns of each run), Columns and Constants
+        (with Participant) as for WriteShort. Runs the participant no longer
+        has are deleted."""
+        self.Table(Task, Spec, Columns)
+        Participant = Constants["Participant"]
+        Insert = "INSERT INTO {} VALUES ({})".format(Quote(Task),
+            ", ".join("?" * len(Columns)))
+        Delete = "DELETE FROM {} WHERE Participant = ? AND Run {} ?".format(
+            Quote(Task), "{}")
+        for RunNum, Trials in enumerate(RunTrials, 1):
+            Values = dict(Constants, Run=RunNum)
+            Cells = []
+            for _, Source in Columns:
+                if isinstance(Source, str):
+                    Cells.append([Values[Source]] * len(Trials))
+                else:
+                    Cells.append(Trials.Values(Source))
+            with self.Connection:
+                self.Connection.execute(Delete.format("="), (Participant, RunNum))
+                self.Connection.executemany(Insert, zip(*Cells))
+        with self.Connection:
+            self.Connection.execute(Delete.format(">"),
+                (Participant, len(RunTrials)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the trial database '
+        'written by ParseEprimeEndopoid.py --sqlite, results are printed as '
+        'csv.')
+    parser.add_argument('--db', required=True, help="sqlite database")
+    parser.add_argument('query', help="SQL query, e.g. \"SELECT * FROM "
+        "Emotional WHERE Run = 3 AND ImageResp IS NULL\"")
+    args = parser.parse_args()
+    Connection = sqlite3.connect(args.db)
+    Cursor = Connection.execute(args.query)
+    Out = csv.writer(sys.stdout, lineterminator="\n")
+    Out.writerow([Column[0] for Column in Cursor.description or []])
+    Out.writerows(["NA" if Value is None else Value for Value in Row]
+        for Row in Cursor)
@@ -0,0 +1,267 @@
+import argparse
+import csv
+import os
+import random
+
+# Writes synthetic eprime logs of every task that ParseEprimeEndopoid.py
+# parses: header, LogFrames with their Level lines and tab indentation,
+# PeriodDuration frames and the block frames (instructText, Run{N}Lists,
+# RunList{N}) logged after their trials. Times are in ms like E-Prime.
+#
+# The blocks of every run (condition, onset and duration) are taken from
+# TaskTemplates.csv, so the trial onsets of a run line up with its template
+# blocks up to the jitter. TrialsPerBlock trials fill the shortest block of
+# a run, longer blocks get more trials at the same spacing.
+#
+# Noise scales the jitter of onsets, durations and reaction times, NoResp
+# is the chance that a trial has no response.
+
+TemplateFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "TaskTemplates.csv")
+
+# task directory -> Task value of its TaskTemplates.csv rows
+TemplateTasks = {"Emotional": "emotion", "VerbalMemA": "verbal",
+    "VerbalMemB": "verbal", "VisualMem": "visual"}
+
+def ReadTemplate(FileName=TemplateFile):
+    """Return the (Condition, TimeOnset, DurationTime) blocks of every
+    (Task, Run) of a TaskTemplates.csv file in onset order, times in s."""
+    Template = {}
+    with open(FileName, newline='') as F:
+        for Row in csv.DictReader(F):
+            Template.setdefault((Row["Task"], int(Row["Run"])), []).append(
+                (Row["Condition"], float(Row["TimeOnset"]),
+                float(Row["DurationTime"])))
+    return {Key: sorted(Blocks, key=lambda Block: Block[1])
+        for Key, Blocks in Template.items()}
+
+def TrialOnsets(Blocks, TrialsPerBlock):
+    """Return the trial onsets (ms from the baseline) of each block."""
+    Spacing = min(Duration for _, _, Duration in Blocks) * 1000 / TrialsPerBlock
+    return [[int(round(Onset * 1000 + Idx * Spacing))
+        for Idx in range(int(round(Duration * 1000 / Spacing)))]
+        for _, Onset, Duration in Blocks]
+
+def Header(Subject, Experiment):
+    return ["*** Header Start ***",
+        "VersionPersist: 1",
+        "LevelName: Session",
+        "LevelName: Block",
+        "LevelName: Trial",
+        "LevelName: SubTrial",
+        "Experiment: " + Experiment,
+        "SessionDate: 03-14-2017",
+        "SessionTime: 10:01:02",
+        "RandomSeed: -1234",
+        "Group: 1",
+        "Subject: " + Subject,
+        "Session: 1",
+        "Display.RefreshRate: 60.000",
+        "*** Header End ***"]
+
+def Frame(Level, Attributes):
+    Indent = "\t" * (Level - 1)
+    Lines = [Indent + "Level: {}".format(Level),
+        Indent + "*** LogFrame Start ***"]
+    for Key, Value in Attributes:
+        Lines.append(Indent + "{}: {}".format(Key, Value))
+    Lines.append(Indent + "*** LogFrame End ***")
+    return Lines
+
+def Jitter(Rng, Noise, Ms):
+    return int(round(Rng.uniform(-Ms, Ms) * Noise))
+
+def Response(Rng, NoResp, Answers):
+    """Return (RESP, ACC) of a trial with correct answer Answers[0]."""
+    if Rng.random() < NoResp:
+        return "", 0
+    Resp = Rng.choice(Answers)
+    return Resp, int(Resp == Answers[0])
+
+def ReactionTime(Rng, Noise, Resp, Low=300, High=1800):
+    if Resp == "":
+        return 0
+    Mid = (Low + High) / 2
+    return max(1, int(Mid + Rng.uniform(Low - Mid, High - Mid) * min(Noise, 1)))
+
+# verbal template condition -> first word of instructText
+VerbalInstructions = {"AC": "Abstract", "UL": "Lower"}
+
+def VerbalMemLines(Rng, Subject, Run, Blocks, TrialsPerBlock=9, Noise=1.0,
+        NoResp=1/3, Task="VerbalMemA"):
+    Lines = Header(Subject, "endopoid_{}_Run{}".format(Task, Run))
+    Baseline = 10000 + Rng.randint(0, 999)
+    Lines += Frame(2, [("Procedure", "DisDaqsProc"),
+        ("myDisDaqs.OnsetTime", Baseline), ("myDisDaqs.OnsetDelay", 12)])
+    for Duration in (32000, 44000, 44000, 44000, 44000, 32000):
+        Lines += Frame(2, [("PeriodList", 1), ("PeriodDuration", Duration),
+            ("Running", "PeriodList")])
+    for Block, ((Condition, _, _), Onsets) in enumerate(zip(Blocks,
+            TrialOnsets(Blocks, TrialsPerBlock)), 1):
+        for Onset in Onsets:
+            Time = Baseline + Onset + Jitter(Rng, Noise, 2)
+            Answer = Rng.choice(["1", "2"])
+            Resp, Acc = Response(Rng, NoResp, [Answer, "2" if Answer == "1" else "1"])
+            Lines += Frame(3, [("Procedure", "TrialProc"),
+                ("myStimulus", "word{}".format(Rng.randint(1, 500))),
+                ("conAbst", Rng.choice("ac")),
+                ("myCase", Rng.choice("lu")),
+                ("Answer", Answer),
+                ("Probe.OnsetTime", Time),
+                ("Probe.ACC", Acc),
+                ("Probe.RT", ReactionTime(Rng, Noise, Resp)),
+                ("Probe.RESP", Resp),
+                ("Probe.OnsetToOnsetTime", 3000 + Jitter(Rng, Noise, 3)),
+                ("fixation.OnsetTime", Time + 3000 + abs(Jitter(Rng, Noise, 17)))])
+        Lines += Frame(2, [("Procedure", "BlockProc"),
+            ("instructText", VerbalInstructions[Condition] + " or not?"),
+            ("Run{}Lists".format(Run), Block),
+            ("Run{}Lists.Cycle".format(Run), 1)])
+    Lines += Frame(1, [("Experiment", "endopoid_{}_Run{}".format(Task, Run))])
+    return Lines
+
+def EmotionalLines(Rng, Subject, Run, Blocks, TrialsPerBlock=5, Noise=1.0,
+        NoResp=1/3):
+    Lines = Header(Subject, "endopoid_Emotional_Run{}".format(Run))
+    # the baseline is the onset of the first image
+    Baseline = 30000 + Rng.randint(0, 999)
+    Image = 1
+    for (Condition, _, _), Onsets in zip(Blocks,
+            TrialOnsets(Blocks, TrialsPerBlock)):
+        for Onset in Onsets:
+            Time = Baseline + Onset + (Jitter(Rng, Noise, 2) if Image > 1 else 0)
+            MyAnswer = "1" if Condition == "Neutral" else "2"
+            Resp, Acc = Response(Rng, NoResp, [MyAnswer, "2" if MyAnswer == "1" else "1"])
+            DelayResp, _ = Response(Rng, NoResp, ["1"])
+            Lines += Frame(3, [("MyImage", "img{}.bmp".format(Image)),
+                ("MyAnswer", MyAnswer),
+                ("Answer", Condition),
+                ("ImageDisplay1.OnsetTime", Time),
+                ("ImageDisplay1.Duration", 2985 + Jitter(Rng, Noise, 3)),
+                ("ImageDisplay1.ACC", Acc),
+                ("ImageDisplay1.RT", ReactionTime(Rng, Noise, Resp, 200, 2000)),
+                ("ImageDisplay1.RESP", Resp),
+                ("ShortDelay.OnsetTime", Time + 3000),
+                ("ShortDelay.Duration", 1000),
+                ("ShortDelay.RT", ReactionTime(Rng, Noise, DelayResp, 0, 900)),
+                ("ShortDelay.RESP", DelayResp)])
+            Image += 1
+    Lines += Frame(1, [("Experiment", "endopoid_Emotional_Run{}".format(Run))])
+    return Lines
+
+# visual template condition -> (Task, Running) of its trials
+VisualLists = {"Match": (1, "MatchTrialList"),
+    "Delay1": (2, "DelayOneTrialList"), "Delay4": (3, "DelayFourTrialList")}
+
+def VisualMemLines(Rng, Subject, Run, Blocks, TrialsPerBlock=4, Noise=1.0,
+        NoResp=1/3):
+    Lines = Header(Subject, "endopoid_VisualMem_Run{}".format(Run))
+    Baseline = 50000 + Rng.randint(0, 999)
+    Lines += Frame(2, [("ClearScreen.OnsetTime", Baseline),
+        ("Procedure", "SetupProc")])
+    for Period in range(1, 10):
+        Lines += Frame(2, [("PeriodList", Period), ("PeriodDuration", 40000),
+            ("Running", "PeriodList")])
+    for Block, ((Condition, _, _), Onsets) in enumerate(zip(Blocks,
+            TrialOnsets(Blocks, TrialsPerBlock)), 1):
+        Task, Running = VisualLists[Condition]
+        for Onset in Onsets:
+            Time = Baseline + Onset + Jitter(Rng, Noise, 3)
+            Answer = Rng.choice(["1", "2"])
+            Resp, Acc = Response(Rng, NoResp, [Answer, "2" if Answer == "1" else "1"])
+            Lines += Frame(4, [("Task", Task),
+                ("Answer", Answer),
+                ("MatchLocation", Rng.choice(["Left", "Right"])),
+                ("Running", Running),
+                ("Response.OnsetTime", Time),
+                ("Response.OffsetTime", Time + 2017 + Jitter(Rng, Noise, 2)),
+                ("Response.ACC", Acc),
+                ("Response.RT", ReactionTime(Rng, Noise, Resp, 200, 2000)),
+                ("Response.RESP", Resp)])
+        Lines += Frame(3, [("IFISBlockList", Block), ("Running", "IFISBlockList"),
+            ("RunList{}".format(Run), Block)])
+    Lines += Frame(1, [("Experiment", "endopoid_VisualMem_Run{}".format(Run))])
+    return Lines
+
+# task -> (line generator, number of runs)
+Generators = {
+    "Emotional": (EmotionalLines, 4),
+    "VerbalMemA": (VerbalMemLines, 4),
+    "VerbalMemB": (VerbalMemLines, 4),
+    "VisualMem": (VisualMemLines, 3),
+}
+
+def TaskLines(Task, Rng, Subject, Run, TrialsPerBlock=None, Noise=1.0,
+        NoResp=1/3, Template=None):
+    """Return the lines of one synthetic run of Task, Template is from
+    ReadTemplate (default TaskTemplates.csv next to this file)."""
+    Template = ReadTemplate() if Template is None else Template
+    Generate = Generators[Task][0]
+    Options = {"Noise": Noise, "NoResp": NoResp}
+    if TrialsPerBlock is not None:
+        Options["TrialsPerBlock"] = TrialsPerBlock
+    if Generate is VerbalMemLines:
+        Options["Task"] = Task
+    return Generate(Rng, Subject, Run, Template[(TemplateTasks[Task], Run)],
+        **Options)
+
+def WriteEprime(FileName, Lines, Encoding="utf-8"):
+    """Write eprime lines with Windows line endings. "utf-16" gives a BOM
+    and little endian text like the files E-Prime writes."""
+    with open(FileName, 'w', encoding=Encoding, newline='') as Out:
+        Out.write("\r\n".join(Lines) + "\r\n")
+
+def EprimeName(Task, Run, Subject):
+    return "endopoid_{}_Run{}-{}-1.txt".format(Task, Run, Subject)
+
+def WriteCohort(Root, NumParticipants, Tasks=("Emotional", "VerbalMemA",
+        "VisualMem"), Raw=False, Encoding="utf-8", Seed=1, First=2,
+        TrialsPerBlock=None, Noise=1.0, NoResp=1/3, Template=TemplateFile):
+    """Write synthetic runs of Tasks for participants First, First+1, ...
+
+    Files go to Root/I<number>/<Task> (as for --root) or, with Raw, all into
+    Root (as for --raw). Template is a TaskTemplates.csv file. Returns the
+    file names written.
+    """
+    Rng = random.Random(Seed)
+    Template = ReadTemplate(Template)
+    FileNames = []
+    for Number in range(First, First + NumParticipants):
+        Subject = "{:03d}".format(Number)
+        for Task in Tasks:
+            OutDir = Root if Raw else os.path.join(Root,
+                "I{:05d}".format(Number), Task)
+            os.makedirs(OutDir, exist_ok=True)
+            for Run in range(1, Generators[Task][1] + 1):
+                FileName = os.path.join(OutDir, EprimeName(Task, Run, Subject))
+                WriteEprime(FileName, TaskLines(Task, Rng, Subject, Run,
+                    TrialsPerBlock, Noise, NoResp, Template), Encoding)
+                FileNames.append(FileName)
+    return FileNames
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write synthetic endopoid '
+        'eprime files.')
+    parser.add_argument('--root', required=True, help="output directory")
+    parser.add_argument('--participants', type=int, default=3,
+        help="number of participants (default 3)")
+    parser.add_argument('--tasks', nargs='+', choices=sorted(Generators),
+        default=["Emotional", "VerbalMemA", "VisualMem"])
+    parser.add_argument('--raw', action='store_true', help="write all files "
+        "into --root like the original eprime directory")
+    parser.add_argument('--utf16', action='store_true',
+        help="write UTF-16 files like E-Prime")
+    parser.add_argument('--trials', type=int, help="trials per block")
+    parser.add_argument('--noise', type=float, default=1.0,
+        help="scale of the timing jitter (default 1)")
+    parser.add_argument('--noresp', type=float, default=1/3,
+        help="chance of a trial without response (default 1/3)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--template', default=TemplateFile,
+        help="block conditions and timing of every run (default the "
+        "TaskTemplates.csv next to this file)")
+    args = parser.parse_args()
+    WriteCohort(args.root, args.participants, args.tasks, args.raw,
+        "utf-16" if args.utf16 else "utf-8", args.seed,
+        TrialsPerBlock=args.trials, Noise=args.noise, NoResp=args.noresp,
+        Template=args.template)
@@ -0,0 +1,138 @@
+from enum import Enum
+
+import numpy as np
+
+# The trials of a run as one typed numpy column per *State member of the
+# task (see ColumnType), built from the raw rows of a TrialMachine:
+#   scaled times and RTs, responses   -- float64, NaN is NA
+#   accuracy                          -- int8
+#   other integers (answers, counters) -- int32
+#   TrialFields with Levels           -- Categorical, int8 codes
+#   other texts (stimuli)             -- object
+
+def ColumnType(Spec, State):
+    """Return how a *State column of Spec is stored: "float", "int8",
+    "int32", "category" or "text"."""
+    for Field in Spec.Fields:
+        if Field.State is State:
+            if Field.Scale or Field.AllowNA:
+                return "float"
+            if Field.Levels is not None:
+                return "category"
+            if Field.Convert is int:
+                return "int8" if State.name.endswith("Acc") else "int32"
+            return "text"
+    # TrialNum, Block
+    return "int32"
+
+def CodeType(NumLevels):
+    return np.int8 if NumLevels < 128 else np.int32
+
+class Categorical:
+    """Text column stored as codes into Levels, -1 is NA. The codes are
+    int8 unless there are more than 127 levels."""
+    def __init__(self, Codes, Levels):
+        self.Codes = Codes
+        self.Levels = tuple(Levels)
+
+    @classmethod
+    def FromValues(cls, Values, Levels=()):
+        """Code Values, texts that are not one of Levels are added as new
+        levels in the order they are found."""
+        Lookup = {Level: Code for Code, Level in enumerate(Levels)}
+        Codes = [Lookup.setdefault(Value, len(Lookup)) if Value != "NA" else -1
+            for Value in Values]
+        return cls(np.array(Codes, dtype=CodeType(len(Lookup))), Lookup)
+
+    @classmethod
+    def Concat(cls, Parts):
+        """Concatenate, recoding each part into the union of the levels."""
+        Lookup = {}
+        for Part in Parts:
+            for Level in Part.Levels:
+                Lookup.setdefault(Level, len(Lookup))
+        Codes = []
+        for Part in Parts:
+            Recode = np.array([Lookup[Level] for Level in Part.Levels] + [-1],
+                dtype=CodeType(len(Lookup)))
+            Codes.append(Recode[Part.Codes])
+        return cls(np.concatenate(Codes), Lookup)
+
+    def __len__(self):
+        return len(self.Codes)
+
+    def Values(self):
+        """Return the texts as an object array, None for NA."""
+        return np.array(self.Levels + (None,), dtype=object)[self.Codes]
+
+class TrialColumns:
+    """Typed trials of one task, one column per *State member. Columns are
+    indexed by state (or state value) like the per state lists of a
+    TrialMachine, the length is the number of trials."""
+    def __init__(self, Spec, Columns):
+        self.Spec = Spec
+        self.Columns = Columns
+        self.Scaled = {Field.State.value for Field in Spec.Fields
+            if Field.Scale}
+
+    def __len__(self):
+        return len(self.Columns[0])
+
+    def __getitem__(self, State):
+        if isinstance(State, Enum):
+            State = State.value
+        return self.Columns[State]
+
+    @classmethod
+    def FromTrials(cls, Spec, Trials, BaselineTime):
+        """Build the columns of the raw per state lists of a TrialMachine
+        (times in ms, "NA"). Times are converted to s relative to
+        BaselineTime a whole column at a time."""
+        Levels = {Field.State: Field.Levels for Field in Spec.Fields}
+        Columns = []
+        for State in Spec.States:
+            Values = Trials[State.value]
+            Type = ColumnType(Spec, State)
+            if Type == "float":
+                if "NA" in Values:
+                    Values = [np.nan if Value == "NA" else Value
+                        for Value in Values]
+                Columns.append(np.array(Values, dtype=np.float64))
+            elif Type == "category":
+                Columns.append(Categorical.FromValues(Values, Levels[State]))
+            elif Type == "text":
+                Columns.append(np.array(Values, dtype=object))
+            else:
+                Columns.append(np.array(Values, dtype=Type))
+        for Field in Spec.Fields:
+            if Field.Scale:
+                Column = Columns[Field.State.value]
+                if Field.Baseline:
+                    Column -= BaselineTime
+                Column /= 1000
+        return cls(Spec, Columns)
+
+    @classmethod
+    def Concat(cls, Parts):
+        """Concatenate the trials of runs or participants of one task."""
+        Columns = []
+        for Idx, Column in enumerate(Parts[0].Columns):
+            if isinstance(Column, Categorical):
+                Columns.append(Categorical.Concat([Part[Idx] for Part in Parts]))
+            else:
+                Columns.append(np.concatenate([Part[Idx] for Part in Parts]))
+        return cls(Parts[0].Spec, Columns)
+
+    def Values(self, State):
+        """Return a column as a list of Python values, None for NA. The
+        float columns of integer fields (responses) give ints."""
+        if isinstance(State, Enum):
+            State = State.value
+        Column = self.Columns[State]
+        if isinstance(Column, Categorical):
+            return Column.Values().tolist()
+        if Column.dtype.kind != 'f':
+            return Column.tolist()
+        Convert = float if State in self.Scaled else int
+        return [None if Value != Value else Convert(Value)
+            for Value in Column.tolist()]